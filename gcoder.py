@@ -21,14 +21,49 @@
 
 from __future__ import print_function
 
-import cairosvg.parser
+import array
+import atexit
+import bisect
+import cPickle
+import collections
+import hashlib
+import importlib
+import json
 import math
 import os
 import re
+import StringIO
 import sys
+import time
+import types
+import xml.etree.cElementTree
+import zlib
+
+
+class _lazy_module(object):
+
+    """Stands in for the module `name` until one of its attributes is
+    first used.  Then it imports the module, and puts the module in
+    gcoder's globals in its own place, so later uses go straight to
+    the module.
+
+    numpy and svgpathtools take longer to import than most g-code
+    scripts take to run, and scripts that don't use SVG paths never
+    need them."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self._name)
+        globals()[self._name] = module
+        return getattr(module, attribute)
+
+
+numpy = _lazy_module('numpy')
 
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'svgpathtools'))
-import svgpathtools
+svgpathtools = _lazy_module('svgpathtools')
 
 
 class line(object):
@@ -139,6 +174,50 @@ class arc_ccw(arc):
     z_path2()."""
 
 
+# The SVG elements that are read as paths, in the order svgpathtools'
+# svg2paths() lists them: all the <path> elements first, then all the
+# <polyline> elements, and so on.  Each one comes with a function that
+# turns the element's attributes into a path `d` string.
+svg_path_elements = [
+    ('path', lambda attributes: attributes.get('d', '')),
+    ('polyline', lambda attributes: svgpathtools.svg_to_paths.polyline2pathd(attributes)),
+    ('polygon', lambda attributes: svgpathtools.svg_to_paths.polygon2pathd(attributes)),
+    ('line', lambda attributes: 'M' + attributes['x1'] + ' ' + attributes['y1'] + 'L' + attributes['x2'] + ' ' + attributes['y2']),
+    ('ellipse', lambda attributes: svgpathtools.svg_to_paths.ellipse2pathd(attributes)),
+    ('circle', lambda attributes: svgpathtools.svg_to_paths.ellipse2pathd(attributes)),
+    ('rect', lambda attributes: svgpathtools.svg_to_paths.rect2pathd(attributes))
+]
+
+svg_namespace = '{http://www.w3.org/2000/svg}'
+
+
+class svg_paths(object):
+
+    """The paths in an SVG file, as a read-only sequence of
+    svgpathtools.path.Path objects.  Each path's `d` string is parsed
+    the first time the path is looked at, so the paths a job doesn't
+    use cost next to nothing."""
+
+    def __init__(self, d_strings):
+        self.d_strings = d_strings
+        self.paths = [None] * len(d_strings)
+
+    def __len__(self):
+        return len(self.d_strings)
+
+    def __getitem__(self, index):
+        d = self.d_strings[index]
+        if index < 0:
+            index += len(self.d_strings)
+        if self.paths[index] is None:
+            self.paths[index] = svgpathtools.parse_path(d)
+        return self.paths[index]
+
+    def __iter__(self):
+        for index in range(len(self.d_strings)):
+            yield self[index]
+
+
 class svg():
     def __init__(self, svg_file):
         self.svg_file = svg_file
@@ -147,11 +226,32 @@ class svg():
         # svg coordinate * scale == mm
         self.scale = 1.0
 
-        self.cairo = cairosvg.parser.Tree(url=self.svg_file)
+        # Read the root element's attributes and the paths in one pass
+        # over the file, throwing away each element once it's read.
+        self.svg_attributes = None
+        elements = dict((tag, []) for (tag, to_d) in svg_path_elements)
+        for (event, element) in xml.etree.cElementTree.iterparse(self.svg_file, events=('start', 'end')):
+            if event == 'start':
+                if self.svg_attributes is None:
+                    self.svg_attributes = dict(element.attrib)
+                continue
+            tag = element.tag
+            if tag.startswith(svg_namespace):
+                tag = tag[len(svg_namespace):]
+            if tag in elements:
+                elements[tag].append(dict(element.attrib))
+            element.clear()
+
+        self.width = self.svg_attributes.get('width')
+        self.viewbox = self.svg_attributes.get('viewBox')
+
+        height = self.svg_attributes.get('height')
+        if height == None:
+            raise SystemExit("SVG has no height: %s" % self.svg_file)
 
-        m = re.match('([0-9.]+)([a-zA-Z]*)', self.cairo['height'])
+        m = re.match('([0-9.]+)([a-zA-Z]*)', height)
         if m == None:
-            raise SystemExit, "failed to parse SVG height: %s" % c['height']
+            raise SystemExit("failed to parse SVG height: %s" % height)
 
         self.height = float(m.group(1))
 
@@ -167,7 +267,12 @@ class svg():
         else:
             raise SystemExit, "weird result from re"
 
-        self.paths, self.attributes = svgpathtools.svg2paths(self.svg_file)
+        d_strings = []
+        self.attributes = []
+        for (tag, to_d) in svg_path_elements:
+            d_strings += [to_d(attributes) for attributes in elements[tag]]
+            self.attributes += elements[tag]
+        self.paths = svg_paths(d_strings)
 
 
     def to_mm_x(self, x_mm):
@@ -190,6 +295,186 @@ class svg():
         return (x, y)
 
 
+def segment_bbox(seg):
+
+    """Returns the bounding box of the path segment `seg`, in the form
+    (xmin, xmax, ymin, ymax).
+
+    The box always includes the segment's `start` and `end` points,
+    even if those have been moved after the segment was created (as
+    split_path_at_intersections() and offset_paths() do)."""
+
+    (xmin, xmax, ymin, ymax) = seg.bbox()
+    for p in (seg.start, seg.end):
+        xmin = min(xmin, p.real)
+        xmax = max(xmax, p.real)
+        ymin = min(ymin, p.imag)
+        ymax = max(ymax, p.imag)
+    return (xmin, xmax, ymin, ymax)
+
+
+def bboxes_overlap(a, b):
+    """Returns True if the two bounding boxes `a` and `b` (in the form
+    (xmin, xmax, ymin, ymax)) touch or overlap, or come within `epsilon`
+    of each other.  Returns False otherwise."""
+    return (a[0] <= b[1] + epsilon) and (b[0] <= a[1] + epsilon) \
+        and (a[2] <= b[3] + epsilon) and (b[2] <= a[3] + epsilon)
+
+
+class bbox_grid(object):
+
+    """A uniform grid spatial index over a set of items, each with a
+    bounding box (xmin, xmax, ymin, ymax).
+
+    The grid covers `bbox`, divided into about `num_items` cells.
+    Items whose boxes extend outside that area are clamped to the
+    edge cells, so the index stays correct (if slower) for items that
+    were not anticipated when the grid was sized.
+
+    Items are tracked by identity, not equality, so distinct but equal
+    svgpathtools segments are kept apart."""
+
+    def __init__(self, bbox, num_items):
+        (self.xmin, xmax, self.ymin, ymax) = bbox
+        cells_per_side = max(1, int(math.ceil(math.sqrt(num_items))))
+        self.cell_size = max(xmax - self.xmin, ymax - self.ymin) / cells_per_side
+        if self.cell_size <= 0.0:
+            self.cell_size = 1.0
+        self.max_ix = int((xmax - self.xmin) / self.cell_size)
+        self.max_iy = int((ymax - self.ymin) / self.cell_size)
+        self.cells = {}
+        self.items = {}
+
+    def _cell_range(self, bbox):
+        (xmin, xmax, ymin, ymax) = bbox
+        ix0 = min(self.max_ix, max(0, int((xmin - epsilon - self.xmin) / self.cell_size)))
+        ix1 = min(self.max_ix, max(0, int((xmax + epsilon - self.xmin) / self.cell_size)))
+        iy0 = min(self.max_iy, max(0, int((ymin - epsilon - self.ymin) / self.cell_size)))
+        iy1 = min(self.max_iy, max(0, int((ymax + epsilon - self.ymin) / self.cell_size)))
+        return (ix0, ix1, iy0, iy1)
+
+    def insert(self, item, bbox):
+        (ix0, ix1, iy0, iy1) = self._cell_range(bbox)
+        self.items[id(item)] = (item, bbox, (ix0, ix1, iy0, iy1))
+        for ix in range(ix0, ix1+1):
+            for iy in range(iy0, iy1+1):
+                self.cells.setdefault((ix, iy), []).append(item)
+
+    def remove(self, item):
+        (item, bbox, (ix0, ix1, iy0, iy1)) = self.items.pop(id(item))
+        for ix in range(ix0, ix1+1):
+            for iy in range(iy0, iy1+1):
+                cell = self.cells[(ix, iy)]
+                for k in range(len(cell)):
+                    if cell[k] is item:
+                        del cell[k]
+                        break
+
+    def query(self, bbox):
+        """Returns a list of all the items whose bounding boxes touch
+        or overlap `bbox`, in no particular order."""
+        (ix0, ix1, iy0, iy1) = self._cell_range(bbox)
+        seen = set()
+        found = []
+        for ix in range(ix0, ix1+1):
+            for iy in range(iy0, iy1+1):
+                for item in self.cells.get((ix, iy), ()):
+                    if id(item) in seen:
+                        continue
+                    seen.add(id(item))
+                    if bboxes_overlap(bbox, self.items[id(item)][1]):
+                        found.append(item)
+        return found
+
+
+def segment_grid(path_list):
+    """Returns a bbox_grid indexing all the segments in `path_list`."""
+    bboxes = [segment_bbox(seg) for seg in path_list]
+    extent = (
+        min(b[0] for b in bboxes),
+        max(b[1] for b in bboxes),
+        min(b[2] for b in bboxes),
+        max(b[3] for b in bboxes)
+    )
+    grid = bbox_grid(extent, len(path_list))
+    for seg, bbox in zip(path_list, bboxes):
+        grid.insert(seg, bbox)
+    return grid
+
+
+def bbox_contains(outer, inner):
+    """Returns True if the bounding box `outer` contains the bounding box
+    `inner` (both in the form (xmin, xmax, ymin, ymax))."""
+    return (outer[0] <= inner[0]) and (inner[1] <= outer[1]) \
+        and (outer[2] <= inner[2]) and (inner[3] <= outer[3])
+
+
+class bbox_tree(object):
+
+    """A bounding volume hierarchy over a fixed set of items, each with a
+    bounding box (xmin, xmax, ymin, ymax).
+
+    Unlike bbox_grid, the tree adapts to how the items are spread out,
+    so it stays fast for drawings with a few big boxes around many
+    small ones.  Each node of the tree has the bounding box of all the
+    items under it, and the items are split between two child nodes
+    at the median of their centers, along the longer side of the box.
+
+    Queries return the items in the order they were given."""
+
+    def __init__(self, items, bboxes, leaf_size=4):
+        self.leaf_size = leaf_size
+        entries = list(zip(range(len(items)), items, bboxes))
+        if entries:
+            self.root = self._build(entries)
+        else:
+            self.root = None
+
+    def _build(self, entries):
+        # Returns a node: (bbox, entries, children).  Leaf nodes have a
+        # list of (index, item, bbox) entries, other nodes have two
+        # children.
+        bbox = (
+            min(e[2][0] for e in entries),
+            max(e[2][1] for e in entries),
+            min(e[2][2] for e in entries),
+            max(e[2][3] for e in entries)
+        )
+        if len(entries) <= self.leaf_size:
+            return (bbox, entries, None)
+        if (bbox[1] - bbox[0]) >= (bbox[3] - bbox[2]):
+            entries.sort(key=lambda e: e[2][0] + e[2][1])
+        else:
+            entries.sort(key=lambda e: e[2][2] + e[2][3])
+        middle = len(entries) // 2
+        return (bbox, None, (self._build(entries[:middle]), self._build(entries[middle:])))
+
+    def query(self, bbox):
+        """Returns a list of all the items whose bounding boxes touch
+        or overlap `bbox`."""
+        found = []
+        stack = []
+        if self.root is not None:
+            stack.append(self.root)
+        while stack:
+            (node_bbox, entries, children) = stack.pop()
+            if not bboxes_overlap(bbox, node_bbox):
+                continue
+            if children is not None:
+                stack.extend(children)
+                continue
+            for entry in entries:
+                if bboxes_overlap(bbox, entry[2]):
+                    found.append(entry)
+        found.sort(key=lambda e: e[0])
+        return [e[1] for e in found]
+
+    def query_point(self, point):
+        """Returns a list of all the items whose bounding boxes contain
+        (or come within epsilon of) the complex number `point`."""
+        return self.query((point.real, point.real, point.imag, point.imag))
+
+
 def split_path_at_intersections(path_list, debug=False):
 
     """`path_list` is a list of connected path segments.  This function
@@ -208,7 +493,20 @@ def split_path_at_intersections(path_list, debug=False):
         earliest_other_seg_index = None
         earliest_other_t = None
 
-        for other_seg_index in range(this_seg_index+2, len(path_list)):
+        # Only segments whose bounding boxes touch this_seg's can
+        # intersect it.  Visit them in path order, so ties between
+        # equally early intersections resolve the same way as a linear
+        # scan would.
+        after = keys[min(this_seg_index+1, len(keys)-1)]
+        candidates = []
+        for other_seg in grid.query(segment_bbox(this_seg)):
+            key = seg_keys[id(other_seg)]
+            if key > after:
+                candidates.append(key)
+        candidates.sort()
+
+        for key in candidates:
+            other_seg_index = bisect.bisect_left(keys, key)
             other_seg = path_list[other_seg_index]
             if debug: print("    other[%d]:" % other_seg_index, other_seg, file=sys.stderr)
             intersections = this_seg.intersect(other_seg)
@@ -240,6 +538,50 @@ def split_path_at_intersections(path_list, debug=False):
     # indexes of the segments that end at the intersection point.
     intersections = []
 
+    if len(path_list) == 0:
+        return []
+
+    # Spatial index of the segments, kept up to date as segments get
+    # split.
+    grid = segment_grid(path_list)
+
+    # An order key for each segment (by id()), so the segments the grid
+    # finds can be put in path order without keeping an index of every
+    # segment up to date.  keys[i] is the key of path_list[i], and the
+    # keys increase along the path, so a segment's index is found by
+    # bisecting `keys`.  The second half of a split segment gets a key
+    # halfway between its neighbors', and the keys are only renumbered
+    # when there's no room left between them.
+    key_spacing = 1 << 32
+    keys = []
+    seg_keys = {}
+
+    def renumber():
+        keys[:] = [i * key_spacing for i in range(len(path_list))]
+        seg_keys.clear()
+        seg_keys.update((id(seg), keys[i]) for i, seg in enumerate(path_list))
+
+    def replace(index, seg):
+        # Puts `seg` in place of path_list[index], with the same key.
+        del seg_keys[id(path_list[index])]
+        path_list[index] = seg
+        seg_keys[id(seg)] = keys[index]
+
+    def insert_after(index, seg):
+        # Inserts `seg` after path_list[index], with a key between its
+        # neighbors'.
+        if index+1 < len(keys) and keys[index+1] - keys[index] < 2:
+            renumber()
+        if index+1 < len(keys):
+            key = (keys[index] + keys[index+1]) // 2
+        else:
+            key = keys[index] + key_spacing
+        path_list.insert(index+1, seg)
+        keys.insert(index+1, key)
+        seg_keys[id(seg)] = key
+
+    renumber()
+
     this_seg_index = 0
     while this_seg_index < len(path_list):
         this_seg = path_list[this_seg_index]
@@ -282,20 +624,25 @@ def split_path_at_intersections(path_list, debug=False):
         assert(complex_close_enough(other_second_seg.end, other_seg.end))
 
         # Replace the old (pre-split) this_seg with the first sub-segment.
-        path_list[this_seg_index] = this_first_seg
+        replace(this_seg_index, this_first_seg)
 
         # Insert the second sub-segment after the first one.
-        path_list.insert(this_seg_index+1, this_second_seg)
+        insert_after(this_seg_index, this_second_seg)
 
         # We inserted a segment before other_seg, so we increment
         # its index.
         other_seg_index += 1
 
         # Replace the old (pre-split) other_seg with the first sub-segment.
-        path_list[other_seg_index] = other_first_seg
+        replace(other_seg_index, other_first_seg)
 
         # Insert the second sub-segment after the first one.
-        path_list.insert(other_seg_index+1, other_second_seg)
+        insert_after(other_seg_index, other_second_seg)
+
+        grid.remove(this_seg)
+        grid.remove(other_seg)
+        for seg in (this_first_seg, this_second_seg, other_first_seg, other_second_seg):
+            grid.insert(seg, segment_bbox(seg))
 
         for i in range(len(intersections)):
             if debug: print("bumping intersection:", file=sys.stderr)
@@ -372,7 +719,10 @@ def split_path_at_intersections(path_list, debug=False):
 def approximate_path_area(path):
 
     """Approximates the path area by converting each Arc to 1,000
-    Lines."""
+    Lines.
+
+    This is slow, use path_area() instead.  It's kept around to
+    cross-check path_area()."""
 
     assert(path.isclosed())
     tmp = svgpathtools.path.Path()
@@ -388,33 +738,1090 @@ def approximate_path_area(path):
     return tmp.area()
 
 
-def offset_paths(path, offset_distance, steps=100, debug=False):
-    """Takes an svgpathtools.path.Path object, `path`, and a float
-    distance, `offset_distance`, and returns the parallel offset curves
-    (in the form of a list of svgpathtools.path.Path objects)."""
+def _cross(a, b):
+    """Returns the z component of the cross product of the complex
+    numbers `a` and `b`, treated as 2d vectors."""
+    return (a.real * b.imag) - (a.imag * b.real)
+
+
+def segment_area(seg):
+
+    """Returns the signed area contribution of the path segment `seg`,
+    which is 1/2 the integral of (x dy - y dx) along the segment (Green's
+    theorem).  Summing this over all the segments of a closed path gives
+    the area enclosed by the path.
+
+    Lines, Quadratic and Cubic Beziers are integrated exactly from their
+    polynomial coefficients.  Arcs (circular or elliptical) are integrated
+    exactly from their center, radii, and swept angle."""
+
+    if type(seg) == svgpathtools.path.Arc:
+        # With the arc parametrized as center + q(theta), the integral
+        # of (center x dq) is (center x (q1 - q0)), and the integral of
+        # (q x dq) is rx * ry * dtheta.
+        c = seg.center
+        q0 = seg.point(0) - c
+        q1 = seg.point(1) - c
+        rx = seg.radius.real
+        ry = seg.radius.imag
+        return 0.5 * (_cross(c, q1 - q0) + (rx * ry * math.radians(seg.delta)))
+
+    # Bezier segments (including Lines): convert the control points to
+    # power-basis coefficients a[k], so that p(t) = sum(a[k] * t**k),
+    # then integrate p(t) x p'(t) term by term.
+    p = seg.bpoints()
+    if len(p) == 2:
+        a = (p[0], p[1] - p[0])
+    elif len(p) == 3:
+        a = (p[0], 2 * (p[1] - p[0]), p[0] - 2 * p[1] + p[2])
+    elif len(p) == 4:
+        a = (
+            p[0],
+            3 * (p[1] - p[0]),
+            3 * (p[0] - 2 * p[1] + p[2]),
+            p[3] - 3 * p[2] + 3 * p[1] - p[0]
+        )
+    else:
+        raise TypeError('segment_area() only accepts Line, QuadraticBezier, CubicBezier, and Arc objects')
+
+    area = 0.0
+    for j in range(len(a)):
+        for k in range(1, len(a)):
+            if j == k:
+                continue
+            area += _cross(a[j], a[k]) * k / float(j + k)
+    return 0.5 * area
+
+
+def path_area(path):
+
+    """Returns the signed area enclosed by the closed path `path`,
+    computed exactly (see segment_area()).
+
+    Positive area means the path runs clockwise (in SVG's Y-down
+    coordinates), negative area means counter-clockwise, matching
+    svgpathtools.Path.area() and approximate_path_area()."""
+
+    assert(path.isclosed())
+    area = 0.0
+    for seg in path:
+        area += segment_area(seg)
+    return area
+
+
+def path_nesting(paths):
+
+    """Works out how the closed svgpathtools.path.Path objects in
+    `paths` nest inside each other (like the outlines of parts, holes
+    in the parts, and islands in the holes).
+
+    Returns a list with an entry for each path: the index in `paths` of
+    the smallest path that encloses it, or None if no path encloses it.
+    Paths are assumed not to cross each other.
+
+    Candidate enclosing paths are found with a bbox_tree, so only paths
+    whose bounding boxes contain the path's bounding box are checked,
+    with a path_polygon (made the first time it's needed)."""
+
+    bboxes = [path.bbox() for path in paths]
+    areas = [abs(path_area(path)) for path in paths]
+    tree = bbox_tree(range(len(paths)), bboxes)
+    polygons = [None] * len(paths)
+
+    parents = []
+    for i in range(len(paths)):
+        point = paths[i][0].point(0.5)
+        candidates = [j for j in tree.query(bboxes[i]) if j != i and areas[j] > areas[i] and bbox_contains(bboxes[j], bboxes[i])]
+        # The smallest enclosing path is the parent.
+        candidates.sort(key=lambda j: areas[j])
+        parent = None
+        for j in candidates:
+            if polygons[j] is None:
+                polygons[j] = path_polygon(paths[j])
+            if polygons[j].contains(point):
+                parent = j
+                break
+        parents.append(parent)
+    return parents
+
+
+def path_depths(parents):
+    """Takes the list of parents returned by path_nesting() and returns
+    the nesting depth of each path: 0 for outermost paths, 1 for the
+    paths directly inside them (holes), 2 for paths inside those
+    (islands), etc."""
+    depths = []
+    for i in range(len(parents)):
+        depth = 0
+        parent = parents[i]
+        while parent is not None:
+            depth += 1
+            parent = parents[parent]
+        depths.append(depth)
+    return depths
+
+
+def rotate_path(path, index):
+    """Returns a copy of the closed svgpathtools.path.Path `path` that
+    starts at the start of its segment number `index`, and goes around
+    the same loop."""
+    segments = list(path)
+    return svgpathtools.Path(*(segments[index:] + segments[:index]))
+
+
+def order_paths(groups, start=None, improve=True):
+
+    """Orders toolpaths to cut down the distance traversed between
+    them.
+
+    `groups` is a list of groups of closed svgpathtools.path.Path
+    objects.  The paths within a group must be cut in the order given
+    (for example the passes around one pocket island, from the outside
+    in), but the groups are independent and may be cut in any order.
+    Since each path is a closed loop, the tool leaves it where it
+    entered it, so each path is also rotated (see rotate_path()) to
+    start at the vertex nearest to where the tool comes from.
+
+    `start` is where the tool is before the first path (a complex
+    number), or None if it doesn't matter.
+
+    The groups are ordered by visiting the nearest one next, then if
+    `improve` is True that order is improved by 2-opt: reversing runs
+    of groups while that makes the total traverse shorter.
+
+    Returns a tuple (groups, before, after): the reordered list of
+    groups of rotated paths, and the total traverse distance of the
+    input order and of the new order."""
+
+    def nearest_vertex(path, point):
+        if point is None:
+            return 0
+        vertices = numpy.array([seg.start for seg in path])
+        return int(numpy.argmin(abs(vertices - point)))
+
+    def place(group, point):
+        # Rotates each path in the group to start near where the
+        # previous one ended.
+        placed = []
+        for path in group:
+            path = rotate_path(path, nearest_vertex(path, point))
+            point = path.start
+            placed.append(path)
+        return placed
+
+    def traverse(groups):
+        distance = 0.0
+        point = start
+        for group in groups:
+            for path in group:
+                if point is not None:
+                    distance += abs(path.start - point)
+                point = path.start
+        return distance
+
+    before = traverse(groups)
+    if len(groups) == 0:
+        return (groups, before, before)
+
+    # Nearest neighbour: go to whichever group's first path has the
+    # vertex nearest to the tool.
+    remaining = list(range(len(groups)))
+    placed = [None] * len(groups)
+    order = []
+    point = start
+    while remaining:
+        if point is None:
+            i = remaining[0]
+        else:
+            i = min(remaining, key=lambda i: min(abs(seg.start - point) for seg in groups[i][0]))
+        remaining.remove(i)
+        placed[i] = place(groups[i], point)
+        point = placed[i][-1].start
+        order.append(i)
+
+    if improve and len(order) > 2:
+        # 2-opt, with each group's entry and exit points as placed
+        # above.  cost[a, b] is the traverse from group a to group b,
+        # the extra row is the traverse from `start`.
+        n = len(groups)
+        entry = numpy.array([placed[i][0].start for i in range(n)])
+        exit = numpy.array([placed[i][-1].start for i in range(n)])
+        cost = numpy.zeros((n + 1, n))
+        cost[:n, :] = abs(entry[numpy.newaxis, :] - exit[:, numpy.newaxis])
+        if start is not None:
+            cost[n, :] = abs(entry - start)
+        cost = cost.tolist()
+
+        improved = True
+        while improved:
+            improved = False
+            # forward[j] and backward[j] are the traverses through
+            # order[:j+1], forwards and reversed.
+            forward = [0.0]
+            backward = [0.0]
+            for j in range(1, n):
+                forward.append(forward[-1] + cost[order[j-1]][order[j]])
+                backward.append(backward[-1] + cost[order[j]][order[j-1]])
+            for i in range(n - 1):
+                if i == 0:
+                    prev = n
+                else:
+                    prev = order[i-1]
+                for k in range(i + 1, n):
+                    delta = cost[prev][order[k]] - cost[prev][order[i]]
+                    delta += (backward[k] - backward[i]) - (forward[k] - forward[i])
+                    if k + 1 < n:
+                        delta += cost[order[i]][order[k+1]] - cost[order[k]][order[k+1]]
+                    if delta < -epsilon:
+                        order[i:k+1] = reversed(order[i:k+1])
+                        improved = True
+                        break
+                if improved:
+                    break
+
+    # Place the paths again, now that it's known where the tool comes
+    # from.
+    ordered = []
+    point = start
+    for i in order:
+        ordered.append(place(groups[i], point))
+        point = ordered[-1][-1].start
+
+    after = traverse(ordered)
+    if after > before:
+        return (groups, before, before)
+    return (ordered, before, after)
+
+
+def segment_points(seg, ts):
+
+    """Evaluates the svgpathtools segment `seg` (a Line, Arc,
+    QuadraticBezier, or CubicBezier) at each of the parameters in `ts`
+    (a sequence of floats, 0 <= t <= 1).  Returns a numpy array of the
+    points, as complex numbers.
+
+    This gives the same points as calling seg.point(t) for each t, but
+    computes them all at once."""
+
+    t = numpy.asarray(ts, dtype=float)
+    if type(seg) == svgpathtools.path.Line:
+        return seg.start + (seg.end - seg.start)*t
+    elif type(seg) == svgpathtools.path.QuadraticBezier:
+        return (1 - t)**2*seg.start + 2*(1 - t)*t*seg.control + t**2*seg.end
+    elif type(seg) == svgpathtools.path.CubicBezier:
+        return seg.start + t*(
+            3*(seg.control1 - seg.start) + t*(
+                3*(seg.start + seg.control2) - 6*seg.control1 + t*(
+                    -seg.start + 3*(seg.control1 - seg.control2) + seg.end
+                )))
+    elif type(seg) == svgpathtools.path.Arc:
+        angle = numpy.radians(seg.theta + t*seg.delta)
+        cosphi = seg.rot_matrix.real
+        sinphi = seg.rot_matrix.imag
+        rx = seg.radius.real
+        ry = seg.radius.imag
+        x = rx*cosphi*numpy.cos(angle) - ry*sinphi*numpy.sin(angle) + seg.center.real
+        y = rx*sinphi*numpy.cos(angle) + ry*cosphi*numpy.sin(angle) + seg.center.imag
+        points = x + 1j*y
+        # Arc.point() returns the endpoints exactly.
+        points[t == 0] = seg.start
+        points[t == 1] = seg.end
+        return points
+    return numpy.array([seg.point(x) for x in t], dtype=complex)
+
+
+def segment_normals(seg, ts):
+
+    """Returns a numpy array of the unit normals of the svgpathtools
+    segment `seg` at each of the parameters in `ts`, the same as
+    calling seg.normal(t) for each t."""
+
+    t = numpy.asarray(ts, dtype=float)
+    if type(seg) == svgpathtools.path.Line:
+        return numpy.full(len(t), seg.normal(0), dtype=complex)
+    elif type(seg) == svgpathtools.path.QuadraticBezier:
+        p = seg.bpoints()
+        derivative = 2*((p[1] - p[0])*(1 - t) + (p[2] - p[1])*t)
+    elif type(seg) == svgpathtools.path.CubicBezier:
+        p = seg.bpoints()
+        derivative = 3*(p[1] - p[0])*(1 - t)**2 + 6*(p[2] - p[1])*(1 - t)*t + 3*(p[3] - p[2])*t**2
+    elif type(seg) == svgpathtools.path.Arc:
+        angle = numpy.radians(seg.theta + t*seg.delta)
+        phi = math.radians(seg.rotation)
+        rx = seg.radius.real
+        ry = seg.radius.imag
+        k = seg.delta*2*math.pi/360
+        derivative = k*(
+            -rx*math.cos(phi)*numpy.sin(angle) - ry*math.sin(phi)*numpy.cos(angle) + 1j*(
+                -rx*math.sin(phi)*numpy.sin(angle) + ry*math.cos(phi)*numpy.cos(angle)))
+    else:
+        return numpy.array([seg.normal(x) for x in t], dtype=complex)
+
+    magnitude = numpy.abs(derivative)
+    normals = numpy.empty(len(t), dtype=complex)
+    ok = magnitude != 0
+    # -1j * the unit tangent.  The parts are divided separately, numpy
+    # complex division by a real rounds differently than Python's.
+    normals.real[ok] = derivative.imag[ok]/magnitude[ok]
+    normals.imag[ok] = -derivative.real[ok]/magnitude[ok]
+    # Where the derivative vanishes (at a cusp, or at an end with a
+    # coincident control point), let svgpathtools find the limit.
+    for i in numpy.flatnonzero(~ok):
+        normals[i] = seg.normal(t[i])
+    return normals
+
+
+def flatten_curve(point, tolerance, max_length=None, min_steps=4, max_depth=16):
+
+    """Computes a linear approximation of a curve.  `point` is a function
+    that takes a parameter `t` (0 <= t <= 1) and returns the point on
+    the curve at `t`, as a complex number (for example the `point()`
+    method of an svgpathtools segment).
+
+    The curve is first split into `min_steps` equal pieces, then each
+    piece is split in half until the midpoint of the piece lies within
+    `tolerance` of the chord between its ends, and (if `max_length` is
+    not None) the chord is no longer than `max_length`.  No piece is
+    split more than `max_depth` times.
+
+    Returns the list of `t` values of the chord endpoints, starting with
+    0.0 and ending with 1.0."""
+
+    def subdivide(t0, p0, t1, p1, depth):
+        tm = (t0 + t1) / 2.0
+        pm = point(tm)
+        if depth < max_depth:
+            chord = p1 - p0
+            chord_length = abs(chord)
+            if chord_length > epsilon:
+                deviation = abs(_cross(chord, pm - p0)) / chord_length
+            else:
+                deviation = abs(pm - p0)
+            if (deviation > tolerance) or ((max_length is not None) and (chord_length > max_length)):
+                subdivide(t0, p0, tm, pm, depth + 1)
+                subdivide(tm, pm, t1, p1, depth + 1)
+                return
+        ts.append(t1)
+
+    ts = [0.0]
+    t0 = 0.0
+    p0 = point(t0)
+    for k in range(1, min_steps + 1):
+        t1 = k / float(min_steps)
+        p1 = point(t1)
+        subdivide(t0, p0, t1, p1, 0)
+        t0 = t1
+        p0 = p1
+    return ts
+
+
+def _chord_distance(p, a, b):
+    # Distance from the point `p` to the line segment from `a` to `b`.
+    chord = b - a
+    length_squared = (chord.real * chord.real) + (chord.imag * chord.imag)
+    if length_squared == 0.0:
+        return abs(p - a)
+    u = ((p.real - a.real) * chord.real + (p.imag - a.imag) * chord.imag) / length_squared
+    if u <= 0.0:
+        return abs(p - a)
+    if u >= 1.0:
+        return abs(p - b)
+    return abs(_cross(chord, p - a)) / math.sqrt(length_squared)
+
+
+def simplify_polyline(points, tolerance):
+
+    """Simplifies the polyline through the list of complex numbers
+    `points`, using the Douglas-Peucker algorithm: the first and last
+    points are kept, and so is the point farthest from the chord between
+    them, if it's more than `tolerance` away.  The two halves on either
+    side of a kept point are simplified the same way.
+
+    Returns the sorted list of the indexes of the points to keep.  The
+    simplified polyline stays within `tolerance` of the original, and
+    its vertices are a subset of the original vertices."""
+
+    if len(points) < 3:
+        return range(len(points))
+
+    keep = [0, len(points) - 1]
+    pending = [(0, len(points) - 1)]
+    while pending:
+        (first, last) = pending.pop()
+        if last - first < 2:
+            continue
+        a = points[first]
+        b = points[last]
+        farthest = None
+        max_distance = tolerance
+        for i in range(first + 1, last):
+            d = _chord_distance(points[i], a, b)
+            if d > max_distance:
+                max_distance = d
+                farthest = i
+        if farthest is not None:
+            keep.append(farthest)
+            pending.append((first, farthest))
+            pending.append((farthest, last))
+    keep.sort()
+    return keep
+
+
+def simplify_path(path, tolerance):
+
+    """Merges runs of consecutive Lines in the svgpathtools.path.Path
+    `path` into fewer, longer Lines, using simplify_polyline().  Other
+    segments, and the endpoints of each run of Lines, are kept as they
+    are.
+
+    Returns a tuple: the new Path, and the number of segments that were
+    removed."""
+
+    segments = []
+    run = []
+    removed = [0]
+
+    def flush_run():
+        if len(run) > 1:
+            points = [run[0].start] + [seg.end for seg in run]
+            keep = simplify_polyline(points, tolerance)
+            for (i, j) in zip(keep, keep[1:]):
+                segments.append(svgpathtools.path.Line(points[i], points[j]))
+            removed[0] += len(run) - (len(keep) - 1)
+        else:
+            segments.extend(run)
+        del run[:]
+
+    for seg in path:
+        if type(seg) == svgpathtools.path.Line:
+            run.append(seg)
+            continue
+        flush_run()
+        segments.append(seg)
+    flush_run()
+
+    return (svgpathtools.Path(*segments), removed[0])
+
+
+def _dot(a, b):
+    """Returns the dot product of the complex numbers `a` and `b`,
+    treated as 2d vectors."""
+    return (a.real * b.real) + (a.imag * b.imag)
+
+
+def tangent_arc(start, tangent, end):
+
+    """Returns the circular arc that starts at `start` heading in the
+    direction of the unit vector `tangent`, and ends at `end`.  The arc is
+    an svgpathtools.path.Arc, or an svgpathtools.path.Line if `end`
+    lies (nearly) straight ahead, or if the arc would be too small for
+    LinuxCNC to accept."""
+
+    chord = end - start
+    chord_length = abs(chord)
+    normal = 1j * tangent
+
+    # Distance of `end` from the line through `start` along `tangent`.
+    side = _dot(chord, normal)
+
+    if abs(side) < epsilon * chord_length:
+        return svgpathtools.path.Line(start, end)
+
+    signed_radius = (chord_length * chord_length) / (2.0 * side)
+    radius = abs(signed_radius)
+    if radius < 0.002:
+        return svgpathtools.path.Line(start, end)
+
+    # The sagitta is how far the arc bulges from its chord.  When that's
+    # negligible, use a Line and avoid emitting huge-radius arcs.
+    if (_dot(chord, tangent) > 0) and (radius - math.sqrt(max(0.0, radius*radius - chord_length*chord_length/4.0)) < epsilon):
+        return svgpathtools.path.Line(start, end)
+
+    # svgpathtools' `sweep` is True when the angle increases along the
+    # arc, i.e. when the center is on the left of `tangent` (positive
+    # `side`).  The arc is longer than a half circle when `end` is behind
+    # `start`.
+    return svgpathtools.path.Arc(
+        start = start,
+        end = end,
+        radius = complex(radius, radius),
+        rotation = 0,
+        large_arc = _dot(chord, tangent) < 0.0,
+        sweep = side > 0.0
+    )
+
+
+def biarc(p0, t0, p1, t1):
+
+    """Returns a pair of tangent-continuous circular arcs (see
+    tangent_arc()) that start at `p0` heading in the direction of the
+    unit vector `t0`, and end at `p1` heading in the direction of the unit
+    vector `t1`.  Returns None if there's no suitable biarc.
+
+    The joint between the two arcs is chosen so the two tangent
+    segments have equal length."""
+
+    v = p1 - p0
+    t = t0 + t1
+    denom = 2.0 * (1.0 - _dot(t0, t1))
+    if abs(denom) < epsilon:
+        # Parallel tangents.
+        vt = _dot(v, t1)
+        if abs(vt) < epsilon:
+            return None
+        d = _dot(v, v) / (4.0 * vt)
+    else:
+        vt = _dot(v, t)
+        d = (-vt + math.sqrt(vt*vt + denom * _dot(v, v))) / denom
+    if d <= 0.0:
+        return None
+
+    joint = (p0 + (d * t0) + p1 - (d * t1)) / 2.0
+    if complex_close_enough(joint, p0) or complex_close_enough(joint, p1):
+        return None
+
+    first = tangent_arc(p0, t0, joint)
+    second = tangent_arc(p1, -t1, joint).reversed()
+    return (first, second)
+
+
+def distance_to_segment(point, seg):
+    """Returns the distance from `point` to the nearest point of `seg`,
+    which must be an svgpathtools.path.Line or a circular
+    svgpathtools.path.Arc."""
+
+    if type(seg) == svgpathtools.path.Line:
+        d = seg.end - seg.start
+        length_squared = _dot(d, d)
+        if length_squared == 0.0:
+            return abs(point - seg.start)
+        u = min(1.0, max(0.0, _dot(point - seg.start, d) / length_squared))
+        return abs(point - (seg.start + u * d))
+
+    v = point - seg.center
+    angle = math.degrees(math.atan2(v.imag, v.real))
+    if seg.delta > 0:
+        swept = (angle - seg.theta) % 360.0
+    else:
+        swept = (seg.theta - angle) % 360.0
+    if swept <= abs(seg.delta):
+        return abs(abs(v) - seg.radius.real)
+    return min(abs(point - seg.start), abs(point - seg.end))
+
+
+def _biarc_error(arcs, points, samples=16):
+    # Checks both ways: `points` (an ordered list of points along the
+    # curve being fit, including its ends) against the arcs, and points
+    # along the arcs against the polyline through `points`.  The second
+    # check catches arcs that bulge away between widely spaced points.
+    error = 0.0
+    for p in points[1:-1]:
+        error = max(error, min(distance_to_segment(p, arc) for arc in arcs))
+    polyline = [svgpathtools.path.Line(a, b) for a, b in zip(points, points[1:])]
+    for arc in arcs:
+        for k in range(1, samples):
+            p = arc.point(k / float(samples))
+            error = max(error, min(distance_to_segment(p, line) for line in polyline))
+    return error
+
+
+def fit_biarcs_to_curve(seg, tolerance, samples=16, max_depth=12):
+
+    """Approximates the svgpathtools segment `seg` (typically a Bezier
+    curve or an elliptical Arc) by a list of tangent-continuous circular
+    Arcs (and Lines, where the curve is straight), deviating from `seg`
+    by no more than `tolerance`.
+
+    The curve is fit by a single biarc if possible, checking the error at
+    `samples` points along the curve.  If the error is too large, the
+    curve is split in half and each half is fit separately, up to
+    `max_depth` times, after which Lines are used."""
+
+    def fit(t0, p0, tan0, t1, p1, tan1, depth):
+        arcs = None
+        if depth < max_depth:
+            arcs = biarc(p0, tan0, p1, tan1)
+        if arcs is not None:
+            points = [seg.point(t0 + (t1 - t0) * k / float(samples)) for k in range(samples + 1)]
+            if _biarc_error(arcs, points) <= tolerance:
+                fitted.extend(arcs)
+                return
+        if depth >= max_depth:
+            fitted.append(svgpathtools.path.Line(p0, p1))
+            return
+        tm = (t0 + t1) / 2.0
+        pm = seg.point(tm)
+        tanm = seg.unit_tangent(tm)
+        fit(t0, p0, tan0, tm, pm, tanm, depth + 1)
+        fit(tm, pm, tanm, t1, p1, tan1, depth + 1)
+
+    fitted = []
+    fit(0.0, seg.start, seg.unit_tangent(0.0), 1.0, seg.end, seg.unit_tangent(1.0), 0)
+    return fitted
+
+
+def fit_biarcs_to_polyline(points, tolerance, max_turn=math.radians(30)):
+
+    """Approximates the polyline through the list of complex numbers
+    `points` by a list of tangent-continuous circular Arcs and Lines,
+    deviating from the polyline by no more than `tolerance`.
+
+    The polyline is treated as a linear approximation of a smooth curve
+    (like the ones offset_paths() makes from Bezier curves).  Vertices
+    where the polyline turns by more than `max_turn` radians are taken to
+    be real corners and are kept.  Each biarc covers as many polyline
+    edges as it can."""
+
+    def direction(a, b):
+        d = b - a
+        return d / abs(d)
+
+    def turn(i):
+        # Turn angle at vertex i.
+        d0 = points[i] - points[i-1]
+        d1 = points[i+1] - points[i]
+        return math.atan2(_cross(d0, d1), _dot(d0, d1))
+
+    def tangent(i, first, last):
+        # Estimated curve tangent at vertex i, for a smooth run of the
+        # polyline from vertex `first` to vertex `last`.
+        if first < i < last:
+            return direction(points[i-1], points[i+1])
+        if last - first < 2:
+            return direction(points[first], points[last])
+        if i == first:
+            # On a circle the tangent differs from the chord by half of
+            # the turn at the next vertex.
+            return direction(points[i], points[i+1]) * complex(math.cos(-turn(i+1)/2.0), math.sin(-turn(i+1)/2.0))
+        return direction(points[i-1], points[i]) * complex(math.cos(turn(i-1)/2.0), math.sin(turn(i-1)/2.0))
+
+    def fits(first, last, run_first, run_last):
+        arcs = biarc(points[first], tangent(first, run_first, run_last), points[last], tangent(last, run_first, run_last))
+        if arcs is None:
+            return None
+        if _biarc_error(arcs, points[first:last+1]) > tolerance:
+            return None
+        return arcs
+
+    # Drop repeated points.
+    unique = [points[0]]
+    for p in points[1:]:
+        if not complex_close_enough(p, unique[-1]):
+            unique.append(p)
+    points = unique
+
+    # Split into smooth runs at the corners.
+    corners = [0]
+    for i in range(1, len(points)-1):
+        if abs(turn(i)) > max_turn:
+            corners.append(i)
+    corners.append(len(points)-1)
+
+    fitted = []
+    for run_first, run_last in zip(corners, corners[1:]):
+        first = run_first
+        while first < run_last:
+            if run_last - first < 2:
+                fitted.append(svgpathtools.path.Line(points[first], points[first+1]))
+                first += 1
+                continue
+
+            # Find the farthest vertex we can reach with one biarc:
+            # gallop out, then bisect.
+            best = None
+            best_last = first + 1
+            step = 2
+            lo = first + 1
+            hi = None
+            while True:
+                last = min(first + step, run_last)
+                arcs = fits(first, last, run_first, run_last)
+                if arcs is None:
+                    hi = last
+                    break
+                best = arcs
+                best_last = last
+                lo = last
+                if last == run_last:
+                    break
+                step *= 2
+            if hi is not None:
+                while hi - lo > 1:
+                    mid = (lo + hi) // 2
+                    arcs = fits(first, mid, run_first, run_last)
+                    if arcs is None:
+                        hi = mid
+                    else:
+                        best = arcs
+                        best_last = mid
+                        lo = mid
+
+            if best is None:
+                fitted.append(svgpathtools.path.Line(points[first], points[first+1]))
+                first += 1
+            else:
+                fitted.extend(best)
+                first = best_last
+    return fitted
+
+
+def fit_arcs(path, tolerance):
+
+    """Returns a new svgpathtools.path.Path like `path`, but with curves
+    replaced by tangent-continuous circular Arcs, deviating from `path` by
+    no more than `tolerance`.
+
+    Bezier curves and elliptical Arcs are fit with
+    fit_biarcs_to_curve().  Runs of two or more consecutive Lines (such
+    as the ones offset_paths() makes from Bezier curves) are fit with
+    fit_biarcs_to_polyline().  Circular Arcs are kept as they are."""
+
+    segments = []
+    run = []
+
+    def flush_run():
+        if len(run) > 1:
+            segments.extend(fit_biarcs_to_polyline([run[0].start] + [seg.end for seg in run], tolerance))
+        else:
+            segments.extend(run)
+        del run[:]
 
+    for seg in path:
+        if type(seg) == svgpathtools.path.Line:
+            run.append(seg)
+            continue
+        flush_run()
+        if type(seg) == svgpathtools.path.Arc and (seg.radius.real == seg.radius.imag):
+            segments.append(seg)
+        else:
+            segments.extend(fit_biarcs_to_curve(seg, tolerance))
+    flush_run()
 
-    def is_enclosed(path, check_paths):
+    return svgpathtools.Path(*segments)
 
-        """`path` is an svgpathtools.path.Path object, `check_paths`
-        is a list of svgpath.path.Path objects.  This function returns
-        True if `path` lies inside any of the paths in `check_paths`,
-        and returns False if it lies outside all of them."""
 
-        seg = path[0]
-        point = seg.point(0.5)
+def refresh_arcs(path):
 
-        for i in range(len(check_paths)):
-            test_path = check_paths[i]
-            if path == test_path:
+    """offset_paths() trims segments by moving their endpoints, but
+    svgpathtools Arcs compute their angles (and so point(), length(),
+    etc) once, when they're created.  This function returns a copy of
+    the svgpathtools.path.Path `path` with each circular Arc replaced by
+    a new Arc with the same center and direction, running between the
+    (possibly moved) endpoints of the old one."""
+
+    segments = []
+    for seg in path:
+        if type(seg) != svgpathtools.path.Arc or seg.radius.real != seg.radius.imag:
+            segments.append(seg)
+            continue
+        start_angle = math.degrees(math.atan2((seg.start - seg.center).imag, (seg.start - seg.center).real))
+        end_angle = math.degrees(math.atan2((seg.end - seg.center).imag, (seg.end - seg.center).real))
+        if seg.sweep:
+            delta = (end_angle - start_angle) % 360.0
+        else:
+            delta = (start_angle - end_angle) % 360.0
+        radius = (abs(seg.start - seg.center) + abs(seg.end - seg.center)) / 2.0
+        segments.append(svgpathtools.path.Arc(
+            start = seg.start,
+            end = seg.end,
+            radius = complex(radius, radius),
+            rotation = 0,
+            large_arc = delta > 180.0,
+            sweep = seg.sweep
+        ))
+    return svgpathtools.Path(*segments)
+
+
+def offset_key(path, offset_distance, **kwargs):
+
+    """Returns a hash (as a hex string) of everything the result of
+    offset_paths(path, offset_distance, **kwargs) depends on: the
+    segments of `path`, exactly (including the state of trimmed Arcs),
+    the offset distance, and the other arguments."""
+
+    h = hashlib.sha1()
+    h.update(repr(offset_distance))
+    h.update(repr(sorted(kwargs.items())))
+    for seg in path:
+        h.update(type(seg).__name__)
+        state = vars(seg)
+        for name in sorted(state.keys()):
+            # Leave out the segment's cached length, it doesn't change
+            # the geometry.
+            if name.startswith('_') or name.startswith('segment_length'):
                 continue
-            # find outside_point, which lies outside other_path
-            (xmin, xmax, ymin, ymax) = test_path.bbox()
-            outside_point = complex(xmax+100, ymax+100)
-            if svgpathtools.path_encloses_pt(point, outside_point, test_path):
-                if debug: print("point is within path", i, file=sys.stderr)
-                return True
-        return False
+            h.update("%s=%r;" % (name, state[name]))
+    return h.hexdigest()
+
+
+class offset_memo(object):
+
+    """Remembers the most recent `max_entries` offset_paths() results
+    in memory, so offsets that are asked for again in the same run
+    (for example by two jobs on the same path) are only computed once.
+
+    Results are looked up by offset_key(), so any path with the same
+    segments finds the result.  A path object that's been looked up
+    before is recognized by its identity, without hashing it again.
+
+    Results that aren't in memory come from `cache` (an offset_cache)
+    if specified, or are computed.  The results are shared, so callers
+    must not change them.
+
+    The memo is passed to worker processes along with the other
+    offset_paths() arguments, but it arrives empty: each process
+    remembers its own results.  `hits` and `misses` count the lookups
+    made in this process."""
+
+    def __init__(self, max_entries=256, cache=None):
+        self.max_entries = max_entries
+        self.cache = cache
+        self.entries = collections.OrderedDict()
+        self.identities = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['entries'] = collections.OrderedDict()
+        state['identities'] = {}
+        state['hits'] = 0
+        state['misses'] = 0
+        return state
+
+    def offset_paths(self, path, offset_distance, debug=False, **kwargs):
+        """Returns offset_paths(path, offset_distance, **kwargs),
+        remembered or computed."""
+        # The identities hold on to the paths, so their ids aren't
+        # reused while they're here.
+        identity = (id(path), offset_distance, tuple(sorted(kwargs.items())))
+        if identity in self.identities:
+            key = self.identities[identity][1]
+        else:
+            key = offset_key(path, offset_distance, **kwargs)
+            self.identities[identity] = (path, key)
+
+        if key in self.entries:
+            self.hits += 1
+            # Move it to the most recently used end.
+            result = self.entries.pop(key)
+            self.entries[key] = result
+            return result
+
+        self.misses += 1
+        if self.cache is not None:
+            result = self.cache.offset_paths(path, offset_distance, debug=debug, **kwargs)
+        else:
+            result = offset_paths(path, offset_distance, debug=debug, **kwargs)
+        self.entries[key] = result
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        if len(self.identities) > 2 * self.max_entries:
+            self.identities = dict((identity, value) for (identity, value) in self.identities.items() if value[1] in self.entries)
+        return result
+
+
+class offset_cache(object):
+
+    """A cache of offset_paths() results on disk, in the directory
+    `directory`, which is created if needed.
+
+    Each result is stored in its own file, named by a hash of
+    everything the result depends on: the input path's segments
+    (exactly, including the state of trimmed Arcs), the offset
+    distance, the flattening and engine arguments, and the version of
+    this code (the contents of gcoder.py and the cache format
+    VERSION).  Changing any of these gives a different file name, so
+    stale results are never used, they just age out.
+
+    The results are stored pickled (the same way multiprocessing
+    passes paths between processes) and compressed, so they come back
+    identical to the ones that were computed.
+
+    When the files add up to more than `max_size` bytes, the least
+    recently used ones are deleted.  Reading a result counts as using
+    it.  Temporary files left behind by writers that were killed are
+    deleted at the same time.
+
+    The cache can be shared by several processes (it's passed to
+    worker processes along with the other offset_paths() arguments).
+    `hits` and `misses` count the lookups made in this process.
+
+    Unpickling can run arbitrary code, so the directory must only be
+    writable by people trusted to run code as the user of the cache."""
+
+    VERSION = 1
+
+    # Temporary files older than this many seconds aren't being written
+    # any more.
+    STALE_TEMPORARY = 60 * 60
+
+    def __init__(self, directory, max_size=100*1024*1024):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Someone else may have just made it.
+                if not os.path.isdir(directory):
+                    raise
+
+        source = os.path.splitext(os.path.abspath(__file__))[0] + ".py"
+        self.version = "%d %s" % (self.VERSION, hashlib.sha1(open(source, 'rb').read()).hexdigest())
+
+        # The total size of the files in the cache, found the first
+        # time it's needed.
+        self.size = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, path, offset_distance, **kwargs):
+        """Returns the cache key for offset_paths(path, offset_distance,
+        **kwargs)."""
+        return hashlib.sha1(self.version + offset_key(path, offset_distance, **kwargs)).hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.directory, key + ".offset")
+
+    def get(self, key):
+        """Returns the cached result for `key`, or None if there isn't
+        one."""
+        filename = self.filename(key)
+        try:
+            data = open(filename, 'rb').read()
+            # Mark it as recently used.
+            os.utime(filename, None)
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        try:
+            result = cPickle.loads(zlib.decompress(data))
+        except Exception:
+            # A damaged file can fail to unpickle in all sorts of ways,
+            # treat it like a missing one (put() replaces it).
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        """Stores `result` in the cache under `key`."""
+        data = zlib.compress(cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL))
+        filename = self.filename(key)
+        # Write a temporary file and rename it into place, so readers
+        # never see a half-written file.
+        temporary = "%s.%d.tmp" % (filename, os.getpid())
+        try:
+            f = open(temporary, 'wb')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(temporary, filename)
+        except BaseException:
+            # Don't leave the temporary file behind (evict() cleans up
+            # after processes that were killed outright).
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            raise
+
+        if self.size is None:
+            self.evict()
+        else:
+            self.size += len(data)
+            if self.size > self.max_size:
+                self.evict()
+
+    def offset_paths(self, path, offset_distance, debug=False, **kwargs):
+        """Returns offset_paths(path, offset_distance, **kwargs) from
+        the cache, computing and storing it if it's not there."""
+        key = self.key(path, offset_distance, **kwargs)
+        result = self.get(key)
+        if result is None:
+            result = offset_paths(path, offset_distance, debug=debug, **kwargs)
+            self.put(key, result)
+        return result
+
+    def evict(self):
+        """Deletes the least recently used files until the cache fits
+        in `max_size`, and any temporary files more than
+        `STALE_TEMPORARY` seconds old, left by writers that died."""
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            filename = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                try:
+                    if now - os.stat(filename).st_mtime > self.STALE_TEMPORARY:
+                        os.remove(filename)
+                except OSError:
+                    pass
+                continue
+            if not name.endswith(".offset"):
+                continue
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, filename))
+        entries.sort()
+        self.size = sum(size for (mtime, size, filename) in entries)
+        for (mtime, size, filename) in entries:
+            if self.size <= self.max_size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            self.size -= size
+
+
+def offset_paths(path, offset_distance, steps=100, flatten_tolerance=None, flatten_max_length=None, debug=False, engine="native", arc_tolerance=None, cache=None):
+    """Takes an svgpathtools.path.Path object, `path`, and a float
+    distance, `offset_distance`, and returns the parallel offset curves
+    (in the form of a list of svgpathtools.path.Path objects).
+
+    Segments that are not Lines or circular Arcs are approximated by
+    Lines.  By default each one is split into `steps` equal steps.
+    If `flatten_tolerance` is specified the steps are chosen by
+    flatten_curve() instead, so that the *offset* curve deviates from
+    its approximation by no more than `flatten_tolerance`, and no Line
+    is longer than `flatten_max_length` (if specified).
+
+    `engine` selects how the offset is computed: "native" (the code
+    below) or "clipper" (see clipper_offset_paths(), which also uses
+    `arc_tolerance`).
+
+    If `cache` (an offset_cache or an offset_memo) is specified, the
+    result is looked up there first, and stored there if it has to be
+    computed."""
+
+    if cache is not None:
+        options = {
+            'steps': steps,
+            'flatten_tolerance': flatten_tolerance,
+            'flatten_max_length': flatten_max_length,
+            'engine': engine,
+            'arc_tolerance': arc_tolerance
+        }
+        return cache.offset_paths(path, offset_distance, debug=debug, **options)
+
+    if engine == "clipper":
+        return clipper_offset_paths(
+            path,
+            offset_distance,
+            steps=steps,
+            flatten_tolerance=flatten_tolerance,
+            flatten_max_length=flatten_max_length,
+            arc_tolerance=arc_tolerance,
+            debug=debug
+        )
+    elif engine != "native":
+        raise ValueError("unknown offset engine '%s'" % engine)
 
 
     # This only works on closed paths.
@@ -508,15 +1915,16 @@ def offset_paths(path, offset_distance, steps=100, debug=False):
             # Deal with any segment that's not a line or a circular arc.
             # This includes elliptic arcs and bezier curves.  Use linear
             # approximation.
-            #
-            # FIXME: Steps should probably be computed dynamically to make
-            #     the length of the *offset* line segments manageable.
-            points = []
-            for k in range(steps+1):
-                t = k / float(steps)
+            def offset_point(t):
                 normal = seg.normal(t)
                 offset_vector = offset_distance * normal
-                points.append(seg.point(t) + offset_vector)
+                return seg.point(t) + offset_vector
+
+            if flatten_tolerance is not None:
+                ts = flatten_curve(offset_point, flatten_tolerance, max_length=flatten_max_length)
+            else:
+                ts = [k / float(steps) for k in range(steps+1)]
+            points = (segment_points(seg, ts) + offset_distance * segment_normals(seg, ts)).tolist()
             for k in range(len(points)-1):
                 start = points[k]
                 end = points[k+1]
@@ -711,8 +2119,9 @@ def offset_paths(path, offset_distance, steps=100, debug=False):
 
     if debug: print("pruning false paths...", file=sys.stderr)
 
-    path_area = approximate_path_area(path)
-    if debug: print("input path area:", path_area, file=sys.stderr)
+    # The Arcs may have been trimmed, compute the areas from fresh ones.
+    input_path_area = path_area(refresh_arcs(path))
+    if debug: print("input path area:", input_path_area, file=sys.stderr)
 
     keepers = []
 
@@ -721,9 +2130,9 @@ def offset_paths(path, offset_distance, steps=100, debug=False):
         # direction from input path.
         for offset_path in offset_paths:
             if debug: print("checking path:", offset_path, file=sys.stderr)
-            offset_path_area = approximate_path_area(offset_path)
+            offset_path_area = path_area(refresh_arcs(offset_path))
             if debug: print("offset path area:", offset_path_area, file=sys.stderr)
-            if path_area * offset_path_area < 0.0:
+            if input_path_area * offset_path_area < 0.0:
                 # Input path and offset path go in the opposite directions,
                 # drop offset path.
                 if debug: print("wrong direction, dropping", file=sys.stderr)
@@ -734,14 +2143,16 @@ def offset_paths(path, offset_distance, steps=100, debug=False):
         # The offset is negative (outwards), discard paths that lie
         # inside any other path and have the same winding direction as
         # the input path.
-        for offset_path in offset_paths:
+        enclosing = enclosing_paths(offset_paths)
+        for (offset_path, enclosed_by) in zip(offset_paths, enclosing):
             if debug: print("checking path:", offset_path, file=sys.stderr)
-            if is_enclosed(offset_path, offset_paths):
+            if enclosed_by:
+                if debug: print("point is within path", enclosed_by[0], file=sys.stderr)
                 if debug: print("    enclosed", file=sys.stderr)
                 # This path is enclosed, check the winding direction.
-                offset_path_area = approximate_path_area(offset_path)
+                offset_path_area = path_area(refresh_arcs(offset_path))
                 if debug: print("offset path area:", offset_path_area, file=sys.stderr)
-                if path_area * offset_path_area > 0.0:
+                if input_path_area * offset_path_area > 0.0:
                     if debug: print("    winding is the same as input, dropping", file=sys.stderr)
                     continue
                 else:
@@ -756,79 +2167,506 @@ def offset_paths(path, offset_distance, steps=100, debug=False):
     return offset_paths
 
 
-def path_to_gcode(svg, path, z_traverse=10, z_approach=None, z_top_of_material=0, z_cut_depth=0, lead_in=True, lead_out=True, feed=None, plunge_feed=None):
-    absolute_arc_centers()
-    (x, y) = svg.to_mm(path[0].start)
+def flatten_path(path, steps=100, flatten_tolerance=None, flatten_max_length=None):
 
-    if z_approach == None:
-        z_approach = 0.5 + z_top_of_material
+    """Approximates the closed svgpathtools.path.Path `path` by a
+    polygon.  Returns the list of its vertices, as complex numbers (the
+    first vertex is not repeated at the end).
 
-    if lead_in:
-        g0(z=z_traverse)
-        g0(x=x, y=y)
+    Lines are kept as they are.  Other segments, including circular
+    Arcs, are split into `steps` equal steps, or if `flatten_tolerance`
+    is specified, into as few steps as flatten_curve() needs to stay
+    within `flatten_tolerance` of the segment, with no step longer than
+    `flatten_max_length` (if specified)."""
 
-    spindle_on()
+    points = []
+    for seg in refresh_arcs(path):
+        if type(seg) == svgpathtools.path.Line:
+            points.append(seg.start)
+            continue
+        if flatten_tolerance is not None:
+            ts = flatten_curve(seg.point, flatten_tolerance, max_length=flatten_max_length)
+        else:
+            ts = [k / float(steps) for k in range(steps+1)]
+        points += segment_points(seg, ts[:-1]).tolist()
+    return points
 
-    if lead_in:
-        g0(z=z_approach)
-        if plunge_feed:
-            set_feed_rate(plunge_feed)
-        elif feed:
-            set_feed_rate(feed)
-        g1(z=z_cut_depth)
-        if plunge_feed and feed:
-            set_feed_rate(feed)
-    else:
-        if feed:
-            set_feed_rate(feed)
-        g1(x=x, y=y)
+
+def preview_path(path, tolerance):
+
+    """Returns a copy of the svgpathtools.path.Path `path` that's only
+    good for looking at: every segment is flattened to within
+    `tolerance` (see flatten_curve()), and the resulting polyline is
+    simplified to within `tolerance` again (see simplify_polyline()).
+    The path can be open or closed.  The result is made of Lines only,
+    usually far fewer of them than `path` has segments."""
+
+    if len(path) == 0:
+        return path
+    points = [path.start]
+    for seg in refresh_arcs(path):
+        if type(seg) == svgpathtools.path.Line:
+            points.append(seg.end)
+            continue
+        ts = flatten_curve(seg.point, tolerance)
+        points += segment_points(seg, ts[1:]).tolist()
+    keep = simplify_polyline(points, tolerance)
+    return svgpathtools.path.Path(*[svgpathtools.path.Line(points[i], points[j]) for (i, j) in zip(keep, keep[1:])])
+
+
+def write_preview(filename, paths, tolerance=None):
+
+    """Writes an SVG file named `filename` showing the list of
+    svgpathtools.path.Path objects `paths`, decimated with
+    preview_path().  If `tolerance` is None it's a thousandth of the
+    larger side of the bounding box of all the paths, which is about
+    as fine as anyone can see on a screen."""
+
+    paths = [path for path in paths if len(path) > 0]
+    if not paths:
+        return
+    if tolerance is None:
+        boxes = [path.bbox() for path in paths]
+        width = max(box[1] for box in boxes) - min(box[0] for box in boxes)
+        height = max(box[3] for box in boxes) - min(box[2] for box in boxes)
+        tolerance = max(width, height) / 1000.0
+    if tolerance > 0:
+        paths = [preview_path(path, tolerance) for path in paths]
+    svgpathtools.paths2svg.wsvg(paths=paths, filename=filename)
+
+
+class path_polygon(object):
+
+    """A closed svgpathtools.path.Path flattened into a polygon (see
+    flatten_path()), for fast point-in-path tests.
+
+    The polygon's edges are kept in numpy arrays, so a containment test
+    is one vectorized pass over the edges instead of intersecting a ray
+    with each Bezier and Arc segment the way
+    svgpathtools.path_encloses_pt() does."""
+
+    def __init__(self, path, steps=100, flatten_tolerance=None, flatten_max_length=None):
+        points = numpy.array(flatten_path(path, steps, flatten_tolerance, flatten_max_length), dtype=complex)
+        self.x0 = points.real
+        self.y0 = points.imag
+        self.x1 = numpy.roll(self.x0, -1)
+        self.y1 = numpy.roll(self.y0, -1)
+        self.bbox = (self.x0.min(), self.x0.max(), self.y0.min(), self.y0.max())
+
+    def winding_number(self, point):
+        """Returns the number of times the polygon winds around the
+        complex number `point`, positive for clockwise (in SVG's Y-down
+        coordinates) and negative for counter-clockwise.  Points
+        outside the polygon have winding number 0."""
+        (x, y) = (point.real, point.imag)
+        (xmin, xmax, ymin, ymax) = self.bbox
+        if x < xmin or x > xmax or y < ymin or y > ymax:
+            return 0
+        # Which side of each edge the point is on.
+        side = (self.x1 - self.x0) * (y - self.y0) - (x - self.x0) * (self.y1 - self.y0)
+        up = (self.y0 <= y) & (self.y1 > y) & (side > 0.0)
+        down = (self.y0 > y) & (self.y1 <= y) & (side < 0.0)
+        return int(numpy.count_nonzero(up)) - int(numpy.count_nonzero(down))
+
+    def contains(self, point):
+        """Returns True if the complex number `point` is inside the
+        polygon, False if it's outside."""
+        return self.winding_number(point) != 0
+
+    def crosses(self, p0, p1):
+        """Returns True if the straight line from the complex number
+        `p0` to `p1` crosses or touches an edge of the polygon, False
+        if it stays clear of them."""
+        (xmin, xmax, ymin, ymax) = self.bbox
+        if max(p0.real, p1.real) < xmin or min(p0.real, p1.real) > xmax \
+                or max(p0.imag, p1.imag) < ymin or min(p0.imag, p1.imag) > ymax:
+            return False
+        # Which side of each edge the ends of the line are on...
+        ex = self.x1 - self.x0
+        ey = self.y1 - self.y0
+        side0 = ex * (p0.imag - self.y0) - (p0.real - self.x0) * ey
+        side1 = ex * (p1.imag - self.y0) - (p1.real - self.x0) * ey
+        # ... and which side of the line the ends of each edge are on.
+        lx = p1.real - p0.real
+        ly = p1.imag - p0.imag
+        side_a = lx * (self.y0 - p0.imag) - (self.x0 - p0.real) * ly
+        side_b = lx * (self.y1 - p0.imag) - (self.x1 - p0.real) * ly
+        crossing = (side0 * side1 <= 0.0) & ((side_a > 0.0) != (side_b > 0.0))
+        return bool(numpy.any(crossing))
+
+
+def enclosing_paths(paths, points=None, steps=100, flatten_tolerance=None, flatten_max_length=None):
+
+    """Works out which of the closed svgpathtools.path.Path objects in
+    `paths` contain which others, all in one go.
+
+    Each path is tested by a single point: `points[i]` for `paths[i]`,
+    or if `points` is not specified, the midpoint of its first segment.
+    Returns a list with an entry for each path: the list of indices of
+    the other paths that contain its point.
+
+    Each path is flattened into a path_polygon once, and the polygons
+    are put in a bbox_tree so each point is only tested against the
+    polygons whose bounding boxes contain it."""
+
+    polygons = [path_polygon(path, steps, flatten_tolerance, flatten_max_length) for path in paths]
+    tree = bbox_tree(range(len(polygons)), [polygon.bbox for polygon in polygons])
+    if points is None:
+        points = [path[0].point(0.5) for path in paths]
+
+    enclosing = []
+    for i in range(len(paths)):
+        enclosing.append([j for j in tree.query_point(points[i]) if j != i and polygons[j].contains(points[i])])
+    return enclosing
+
+
+class transition_planner(object):
+
+    """Decides how the tool gets from the end of one pocket pass to the
+    start of the next: by feeding straight there along the floor of the
+    pocket, or by raising, traversing, and plunging.
+
+    `walls` is a list of closed paths the tool must not cross, because
+    the material on the other side is the wall of the pocket (the
+    slotting paths).  `passes` is the list of closed paths cut after
+    them, in order.
+
+    Feeding straight to the next pass is safe if the move doesn't cross
+    a wall, and doesn't cross any pass that hasn't been cut yet (except
+    where it reaches the start of the next pass).  The material left
+    in the pocket is all inside the passes still to be cut, so the tool
+    never takes a bigger bite than one of those passes would.
+
+    The paths are flattened into path_polygon objects, and kept in
+    bbox_trees so each move is only checked against the paths near
+    it."""
+
+    def __init__(self, walls, passes, steps=100, flatten_tolerance=None, flatten_max_length=None):
+        self.walls = [path_polygon(path, steps, flatten_tolerance, flatten_max_length) for path in walls]
+        self.wall_tree = bbox_tree(range(len(self.walls)), [polygon.bbox for polygon in self.walls])
+        self.passes = [path_polygon(path, steps, flatten_tolerance, flatten_max_length) for path in passes]
+        self.pass_tree = bbox_tree(range(len(self.passes)), [polygon.bbox for polygon in self.passes])
+        self.starts = [path.start for path in passes]
+        self.ends = [path.end for path in passes]
+
+    def can_feed(self, point, i):
+        """Returns True if the tool can feed straight from the complex
+        number `point` to the start of pass number `i`, once the passes
+        before it have been cut.  Returns False if it has to go around
+        (raise, traverse, and plunge)."""
+
+        start = self.starts[i]
+        if abs(start - point) < epsilon:
+            return True
+
+        # Leave the ends of the move out of the checks, the tool is on
+        # a path at one end and on the next pass at the other.
+        p0 = point + 1e-6 * (start - point)
+        p1 = start + 1e-6 * (point - start)
+        bbox = (min(p0.real, p1.real), max(p0.real, p1.real), min(p0.imag, p1.imag), max(p0.imag, p1.imag))
+
+        for j in self.wall_tree.query(bbox):
+            if self.walls[j].crosses(p0, p1):
+                return False
+
+        for j in self.pass_tree.query(bbox):
+            if j >= i and self.passes[j].crosses(p0, p1):
+                return False
+
+        return True
+
+    def plan(self, point):
+        """Returns a list with an entry for each pass: True if the tool
+        can feed to its start from where the previous pass ended (or
+        from the complex number `point`, for the first pass), False if
+        it can't."""
+        feeds = []
+        for i in range(len(self.passes)):
+            feeds.append(self.can_feed(point, i))
+            point = self.ends[i]
+        return feeds
+
+
+def clipper_offset_paths(path, offset_distance, steps=100, flatten_tolerance=None, flatten_max_length=None, arc_tolerance=None, scale=2**20, islands=None, debug=False):
+
+    """Computes the same offset as offset_paths(), using the Clipper
+    polygon offsetting library (the pyclipper module) instead.
+
+    The path is flattened into a polygon (see flatten_path()), the
+    polygon's vertices are rounded to integer multiples of 1/`scale`,
+    and Clipper offsets it, with rounded corners.  The rounded corners
+    are approximated by lines within `flatten_tolerance` (0.001 if not
+    specified).
+
+    The result is a list of closed svgpathtools.path.Path objects, made
+    of Lines, running in the same direction as `path`.  If
+    `arc_tolerance` is specified, the Lines are passed through
+    fit_arcs(), to turn them back into Arcs where they can be.
+
+    `islands` is an optional list of closed paths inside `path` (the
+    bosses left standing in a pocket, say).  Then the region inside
+    `path` and outside the islands is offset as a whole, and the loops
+    around the islands are returned too, running the opposite way to
+    `path`.  offset_paths() can't do this."""
+
+    try:
+        import pyclipper
+    except ImportError:
+        raise ImportError("the 'clipper' offset engine needs the pyclipper module")
+
+    assert(path.isclosed())
+
+    def clipper_polygon(path, outer):
+        # Clipper tells the outside of a region from its holes by
+        # which way the polygons run.
+        points = flatten_path(path, steps=steps, flatten_tolerance=flatten_tolerance, flatten_max_length=flatten_max_length)
+        polygon = pyclipper.scale_to_clipper([(p.real, p.imag) for p in points], scale)
+        if pyclipper.Orientation(polygon) != outer:
+            polygon.reverse()
+        return polygon
+
+    tolerance = flatten_tolerance
+    if tolerance is None:
+        tolerance = 0.001
+
+    offsetter = pyclipper.PyclipperOffset()
+    offsetter.ArcTolerance = tolerance * scale
+    offsetter.AddPath(clipper_polygon(path, True), pyclipper.JT_ROUND, pyclipper.ET_CLOSEDPOLYGON)
+    for island in islands or []:
+        assert(island.isclosed())
+        offsetter.AddPath(clipper_polygon(island, False), pyclipper.JT_ROUND, pyclipper.ET_CLOSEDPOLYGON)
+
+    # Clipper grows a polygon by a positive distance whichever way it
+    # runs.  offset_paths() offsets a positive distance to the left of
+    # the path: that shrinks a counter-clockwise path, and grows a
+    # clockwise one.
+    clockwise = path_area(path) > 0
+    delta = -offset_distance
+    if clockwise:
+        delta = offset_distance
+    result = offsetter.Execute(delta * scale)
+    if debug: print("clipper returned %d polygons" % len(result), file=sys.stderr)
+
+    offset_paths = []
+    for polygon in result:
+        hole = not pyclipper.Orientation(polygon)
+        if hole and not islands:
+            # offset_paths() doesn't return holes.
+            if debug: print("dropping hole", file=sys.stderr)
+            continue
+        points = [complex(x, y) for (x, y) in pyclipper.scale_from_clipper(polygon, scale)]
+        segments = []
+        for i in range(len(points)):
+            segments.append(svgpathtools.Line(points[i-1], points[i]))
+        offset_path = svgpathtools.Path(*segments)
+        if (path_area(offset_path) > 0) != (clockwise != hole):
+            offset_path = offset_path.reversed()
+        if arc_tolerance is not None:
+            offset_path = fit_arcs(offset_path, arc_tolerance)
+        offset_paths.append(offset_path)
+
+    return offset_paths
+
+
+def offset_rings(path, offset_distance, step, **kwargs):
+
+    """Generates successive inward offsets of the svgpathtools.path.Path
+    `path`, for pocketing.  The first ring is at `offset_distance`
+    from `path`, each following ring is `step` farther in, until
+    nothing is left.  Each ring is yielded as a list of
+    svgpathtools.path.Path objects, as returned by offset_paths() (any
+    other keyword arguments are passed to offset_paths()).
+
+    Offsetting a closed path inwards by `a` and then the result inwards
+    by `b` gives the same path as offsetting the original inwards by
+    `a+b`.  So each ring is computed from the previous ring, instead of
+    from `path`.  The previous ring is smaller, and has already lost
+    the parts of the path that don't reach that far in, so this is much
+    cheaper than offsetting `path` by the full distance each time."""
+
+    if step <= 0:
+        raise ValueError("offset_rings() needs a positive (inward) step, got %f" % step)
+
+    ring = offset_paths(path, offset_distance, **kwargs)
+    while ring:
+        yield ring
+        next_ring = []
+        for ring_path in ring:
+            next_ring += offset_paths(refresh_arcs(ring_path), step, **kwargs)
+        ring = next_ring
+
+
+class toolpath(object):
+
+    """A toolpath is a path compiled into a list of g-code moves in the
+    XY plane, in mm (see compile_path()).  It can be written out at any
+    Z level, any number of times, by program.toolpath_to_gcode().
+
+    The moves are kept in arrays: `motions` holds the kind of each move
+    (LINE, ARC_CW, or ARC_CCW), `xy` holds the X and Y of the end of
+    each move, and `ij` holds the X and Y of the center of each arc (0
+    for lines).  `start` is the (x, y) where the toolpath starts, and
+    `removed` is the number of segments and moves that were removed by
+    simplification."""
+
+    LINE = 0
+    ARC_CW = 1
+    ARC_CCW = 2
+
+    def __init__(self, start):
+        self.start = start
+        self.motions = array.array('b')
+        self.xy = array.array('d')
+        self.ij = array.array('d')
+        self.removed = 0
+
+        # The g-code text of the moves, as written by each kind of
+        # program that has written this toolpath so far (see
+        # program._toolpath_moves()).
+        self.rendered = {}
+
+    def __len__(self):
+        return len(self.motions)
+
+    def line_to(self, x, y):
+        self.motions.append(self.LINE)
+        self.xy.extend((x, y))
+        self.ij.extend((0.0, 0.0))
+
+    def lines_to(self, xs, ys):
+        """Adds a line to each of the points in the sequences `xs`
+        and `ys`."""
+        xy = numpy.empty(2 * len(xs))
+        xy[0::2] = xs
+        xy[1::2] = ys
+        self.motions.extend(array.array('b', [self.LINE]) * len(xs))
+        self.xy.fromlist(xy.tolist())
+        self.ij.fromlist([0.0] * len(xy))
+
+    def arc_to(self, x, y, i, j, clockwise):
+        if clockwise:
+            self.motions.append(self.ARC_CW)
+        else:
+            self.motions.append(self.ARC_CCW)
+        self.xy.extend((x, y))
+        self.ij.extend((i, j))
+
+
+def compile_path(svg, path, flatten_tolerance=None, flatten_max_length=None, arc_tolerance=None, simplify_tolerance=None):
+
+    """Compiles the svgpathtools.path.Path `path`, from the SVG `svg`,
+    into a toolpath object.  This does all the work of converting the
+    path to g-code except the writing, so a path that's cut at several
+    depths only needs to be compiled once.
+
+    Lines and circular Arcs become g1, g2, and g3 moves.  Other segments
+    are approximated by g1 moves: 1000 equal steps each by default,
+    or if `flatten_tolerance` is specified, as few steps as flatten_curve()
+    needs to stay within `flatten_tolerance` mm of the curve, with no
+    step longer than `flatten_max_length` mm (if specified).
+
+    If `arc_tolerance` is specified, the path is first passed through
+    fit_arcs(), so that curves and runs of short Lines are cut with
+    g2 and g3 moves, staying within `arc_tolerance` mm of the path.
+
+    If `simplify_tolerance` is specified, runs of Lines in the path,
+    and the g1 moves approximating each curve, are simplified with
+    simplify_polyline(), dropping vertices that are within
+    `simplify_tolerance` mm of the simplified path.  This should be
+    no more than the path blending tolerance (see path_blend())."""
+
+    if arc_tolerance is not None:
+        # The tolerance is in mm, the path is in SVG units.
+        path = fit_arcs(path, arc_tolerance / svg.scale)
+
+    removed = 0
+    if simplify_tolerance is not None:
+        (path, removed) = simplify_path(path, simplify_tolerance / svg.scale)
+
+    result = toolpath(svg.to_mm(path[0].start))
+    result.removed = removed
 
     for element in path:
         if type(element) == svgpathtools.path.Line:
-            (start_x, start_y) = svg.to_mm(element.start)
             (end_x, end_y) = svg.to_mm(element.end)
-            g1(x=end_x, y=end_y)
+            result.line_to(end_x, end_y)
         elif type(element) == svgpathtools.path.Arc:
             # FIXME: g90.1 or g91.1?
             if element.radius.real != element.radius.imag:
                 raise ValueError, "arc radii differ: %s", element
             (end_x, end_y) = svg.to_mm(element.end)
             (center_x, center_y) = svg.to_mm(element.center)
-            if element.sweep:
-                g2(x=end_x, y=end_y, i=center_x, j=center_y)
-            else:
-                g3(x=end_x, y=end_y, i=center_x, j=center_y)
+            result.arc_to(end_x, end_y, center_x, center_y, element.sweep)
         else:
             # Deal with any segment that's not a line or a circular arc,
             # this includes elliptic arcs and bezier curves.  Use linear
             # approximation.
-            #
-            # FIXME: The number of steps should probably be dynamically
-            #     adjusted to make the length of the *offset* line
-            #     segments manageable.
-            steps = 1000
-            for k in range(steps+1):
-                t = k / float(steps)
-                end = element.point(t)
-                (end_x, end_y) = svg.to_mm(end)
-                g1(x=end_x, y=end_y)
-
-    if lead_out:
-        g1(z=z_approach)
-        g0(z=z_traverse)
-
-
-# These keep track of where the most recent move left the controlled
-# point, or None if the position is not known.
-current_x = None
-current_y = None
-current_z = None
-current_a = None
-current_b = None
-current_c = None
-current_u = None
-current_v = None
-current_w = None
+            if flatten_tolerance is not None:
+                # The tolerances are in mm, the path is in SVG units.
+                if flatten_max_length is not None:
+                    max_length = flatten_max_length / svg.scale
+                else:
+                    max_length = None
+                ts = flatten_curve(element.point, flatten_tolerance / svg.scale, max_length=max_length)
+            else:
+                steps = 1000
+                ts = [k / float(steps) for k in range(steps+1)]
+            points = segment_points(element, ts)
+            if simplify_tolerance is not None:
+                keep = simplify_polyline(points.tolist(), simplify_tolerance / svg.scale)
+                result.removed += len(points) - len(keep)
+                points = points[keep]
+            # The same as svg.to_mm() on each point.
+            result.lines_to(points.real * svg.scale, svg.height - points.imag * svg.scale)
+
+    return result
+
+
+class writer(object):
+
+    """The writer class collects g-code text and writes it to a file-like
+    object in large chunks, instead of making many small writes.
+
+    `sink` is the object the g-code is written to (anything with a
+    `write()` method, like an open file, a pipe, or a StringIO).  Text
+    is held in memory until at least `chunk_size` characters have been
+    collected, or until flush() is called.
+
+    If `sink` is None, the g-code goes straight through to whatever
+    sys.stdout is at the time, a line at a time, so it stays in order
+    with anything else the program prints.  sys.stdout does its own
+    buffering."""
+
+    def __init__(self, sink=None, chunk_size=64*1024):
+        self.sink = sink
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.buffered = 0
+
+    def write(self, text):
+        if self.sink is None:
+            sys.stdout.write(text)
+            return
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def line(self, text=""):
+        """Writes `text` (a whole line of g-code, without the newline)
+        followed by a newline."""
+        self.write(text + "\n")
+
+    def flush(self):
+        sink = self.sink
+        if sink is None:
+            sink = sys.stdout
+        if self.buffer:
+            sink.write("".join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+        if hasattr(sink, 'flush'):
+            sink.flush()
 
 
 # When comparing floats, a difference of less than epsilon counts as no
@@ -850,655 +2688,1310 @@ def complex_close_enough(a, b):
     return False
 
 
-def init():
-    print()
-    print("; init")
-    print("G20          (inch)")
-    print("G17          (xy plane)")
-    print("G90          (absolute)")
-    print("G91.1        (arc centers are relative to arc starting point)")
-    cutter_comp_off()
-    print("G54          (switch to coordinate system 1)")
-    print("G94          (units/minute feed mode)")
-    print("G99          (in canned cycles, retract to the Z coordinate specified by the R word)")
-    print("G64 P0.0005  (enable path blending, but stay within 0.0005 of the programmed path)")
-    print("G49          (turn off tool length compensation)")
-    print("G80          (turn off canned cycles)")
-    print()
-
-
-def comment(msg):
-    if msg:
-        print(";", msg)
-    else:
-        print()
+class machine_profile(object):
+
+    """The motion limits of a machine, used by cycle_time_estimator.
+
+    `axes` is a dict mapping each axis letter ('x', 'y', 'z') to a
+    dict of its limits, all optional:
+
+        'max-velocity': the fastest the axis moves (and the speed of
+            rapids), in mm/minute.
+        'max-acceleration': in mm/second^2.
+        'max-jerk': in mm/second^3.
+
+    Limits that aren't given default to `max_velocity` (for
+    'max-velocity') or to no limit at all.
+
+    `junction_deviation` (in mm) sets how fast the machine goes around
+    corners between moves, as in Grbl: the bigger it is, the faster
+    the corners.
+
+    load_machine_profile() reads a profile from a json file."""
+
+    def __init__(self, axes=None, max_velocity=3000.0, junction_deviation=0.01):
+        if axes is None:
+            axes = {}
+        self.max_velocity = {}
+        self.max_acceleration = {}
+        self.max_jerk = {}
+        for axis in "xyz":
+            limits = axes.get(axis, {})
+            self.max_velocity[axis] = limits.get('max-velocity', max_velocity) / 60.0
+            self.max_acceleration[axis] = limits.get('max-acceleration', None)
+            self.max_jerk[axis] = limits.get('max-jerk', None)
+        self.junction_deviation = junction_deviation
+
+    def limit(self, limits, direction):
+        """Returns the limit (from one of the per-axis dicts) on a
+        move in the direction `direction` (a unit vector (x, y, z)),
+        or None if no axis limits it.  Each axis can only go as fast
+        as its own limit, so the move is limited by the axis that would
+        go over its limit first."""
+        result = None
+        for (axis, component) in zip("xyz", direction):
+            if limits[axis] is None or abs(component) < epsilon:
+                continue
+            axis_limit = limits[axis] / abs(component)
+            if result is None or axis_limit < result:
+                result = axis_limit
+        return result
+
+
+def load_machine_profile(filename, max_velocity=3000.0):
+
+    """Reads a machine_profile from the json file `filename`, which
+    holds a hash like this:
+
+        {
+            "axes": {
+                "x": { "max-velocity": 5000, "max-acceleration": 500, "max-jerk": 5000 },
+                "y": { "max-velocity": 5000, "max-acceleration": 500, "max-jerk": 5000 },
+                "z": { "max-velocity": 2000, "max-acceleration": 200 }
+            },
+            "junction-deviation": 0.01
+        }
+
+    Axes and limits that aren't in the file get the defaults described
+    in machine_profile, with `max_velocity` for velocity."""
+
+    data = json.load(open(filename))
+    axes = {}
+    if "axes" in data.keys():
+        for (axis, limits) in data['axes'].items():
+            axis = axis.lower()
+            if axis not in ("x", "y", "z"):
+                raise ValueError("unknown axis '%s' in machine profile %s" % (axis, filename))
+            axes[axis] = limits
+    junction_deviation = 0.01
+    if "junction-deviation" in data.keys():
+        junction_deviation = data['junction-deviation']
+    return machine_profile(axes, max_velocity=max_velocity, junction_deviation=junction_deviation)
+
+
+class cycle_time_estimator(object):
+
+    """Estimates how long a g-code program takes to run.
+
+    A cycle_time_estimator is a file-like object: use it as the sink of
+    a program (or write g-code to it some other way), and it reads the
+    moves as they go by, and passes the text on to `sink` (see the
+    writer class).
+
+    Each move gets a trapezoidal velocity profile, from the speed it
+    enters at to the speed it leaves at, within the feed rate and the
+    velocity and acceleration limits of the axes in `profile` (a
+    machine_profile).  The speed through each corner is limited by the
+    profile's junction deviation, and the speeds are planned over the
+    whole program, so the machine slows down in time for the corners
+    and the end.  Arcs are also limited by centripetal acceleration.
+    Jerk limits make each speed change take a little longer, but
+    don't change the distance it takes.
+
+    Time is counted in three kinds: "rapid" for G0 moves, "plunge"
+    for feed moves straight down the Z axis, and "cutting" for all
+    other feed moves (including feeding straight back up).  The time
+    is also divided up into sections (see section()), for example one
+    for each job.
+
+    Only G0, G1, G2, and G3 moves in the XY plane, with absolute
+    coordinates, are understood, other codes take no time.  Moves in
+    machine coordinates (G53) take no time either, since where they go
+    in the program's coordinates isn't known, and they leave the
+    position of the axes they move unknown until the next move sets
+    it."""
+
+    RAPID = "rapid"
+    PLUNGE = "plunge"
+    CUTTING = "cutting"
+    KINDS = (CUTTING, RAPID, PLUNGE)
+
+    def __init__(self, profile=None, sink=None):
+        if profile is None:
+            profile = machine_profile()
+        self.profile = profile
+        self.sink = sink
+        self.partial_line = ""
+
+        self.units = 1.0
+        self.arc_centers_relative = True
+        self.motion = None
+        self.feed = None
+        self.position = [None, None, None]
+
+        self.sections = []
+        self.section("program")
+
+        # The moves, as (section, kind, length, speed, acceleration,
+        # jerk, entry direction, exit direction) tuples.  Speeds are in
+        # mm/s.
+        self.moves = []
+
+    def section(self, name):
+        """Counts the time of the moves from here on towards the
+        section called `name`.  If the estimator is a program's sink,
+        flush the program first."""
+        self.sections.append(name)
+
+    def write(self, text):
+        sink = self.sink
+        if sink is None:
+            sink = sys.stdout
+        sink.write(text)
+
+        lines = (self.partial_line + text).split("\n")
+        self.partial_line = lines.pop()
+        for line in lines:
+            self.parse_line(line)
+
+    def flush(self):
+        sink = self.sink
+        if sink is None:
+            sink = sys.stdout
+        if hasattr(sink, 'flush'):
+            sink.flush()
+
+    _word = re.compile(r'([A-Z])\s*([-+]?[0-9]*\.?[0-9]*)')
+
+    def parse_line(self, line):
+        """Reads one line of g-code."""
+        line = re.sub(r'\([^)]*\)', '', line.split(';')[0]).upper()
+        words = {}
+        motion = None
+        machine_coordinates = False
+        for (letter, value) in self._word.findall(line):
+            if letter == 'G':
+                if value in ('0', '1', '2', '3', '00', '01', '02', '03'):
+                    motion = int(value)
+                elif value == '53':
+                    machine_coordinates = True
+                elif value == '20':
+                    self.units = 25.4
+                elif value == '21':
+                    self.units = 1.0
+                elif value == '90.1':
+                    self.arc_centers_relative = False
+                elif value == '91.1':
+                    self.arc_centers_relative = True
+                elif value == '80':
+                    self.motion = None
+            elif letter == 'F':
+                self.feed = float(value) * self.units / 60.0
+            elif letter in 'XYZIJ':
+                words[letter] = float(value) * self.units
+        if motion is not None:
+            self.motion = motion
+        if self.motion is None or not ('X' in words or 'Y' in words or 'Z' in words):
+            return
+
+        start = self.position
+        end = list(start)
+        for (k, letter) in enumerate('XYZ'):
+            if letter in words:
+                end[k] = words[letter]
+        if machine_coordinates:
+            # Where the machine coordinates are in the program's
+            # coordinates isn't known, so neither is how far the move
+            # goes, or where it leaves the axes it moves.
+            for (k, letter) in enumerate('XYZ'):
+                if letter in words:
+                    end[k] = None
+            self.position = end
+            return
+        self.position = end
+        if None in start or None in end:
+            # Nowhere to move from yet.
+            return
+
+        delta = [end[k] - start[k] for k in range(3)]
+        if self.motion in (2, 3):
+            self.add_arc(start, end, words)
+            return
+        length = math.sqrt(sum(d * d for d in delta))
+        if length < epsilon:
+            return
+        direction = tuple(d / length for d in delta)
+        if self.motion == 0:
+            kind = self.RAPID
+            speed = self.profile.limit(self.profile.max_velocity, direction)
+        else:
+            if abs(delta[0]) < epsilon and abs(delta[1]) < epsilon and delta[2] < 0:
+                kind = self.PLUNGE
+            else:
+                kind = self.CUTTING
+            speed = self.feed
+            axis_speed = self.profile.limit(self.profile.max_velocity, direction)
+            if speed is None or speed > axis_speed:
+                speed = axis_speed
+        self.add_move(kind, length, speed, direction, direction, direction)
+
+    def add_arc(self, start, end, words):
+        if self.arc_centers_relative:
+            center = (start[0] + words.get('I', 0.0), start[1] + words.get('J', 0.0))
+        else:
+            center = (words.get('I', 0.0), words.get('J', 0.0))
+        (sx, sy) = (start[0] - center[0], start[1] - center[1])
+        (ex, ey) = (end[0] - center[0], end[1] - center[1])
+        radius = math.sqrt(sx * sx + sy * sy)
+        if radius < epsilon:
+            return
+        sweep = math.atan2(ey, ex) - math.atan2(sy, sx)
+        if self.motion == 2:
+            # Clockwise, the sweep is negative.
+            if sweep >= -epsilon:
+                sweep -= 2 * math.pi
+            (entry, exit) = ((sy, -sx), (ey, -ex))
+        else:
+            if sweep <= epsilon:
+                sweep += 2 * math.pi
+            (entry, exit) = ((-sy, sx), (-ey, ex))
+        dz = end[2] - start[2]
+        length = math.sqrt(pow(abs(sweep) * radius, 2) + dz * dz)
+        entry = (entry[0] / radius, entry[1] / radius, 0.0)
+        exit = (exit[0] / radius, exit[1] / radius, 0.0)
+
+        # The arc moves X and Y at up to full speed at some point, so
+        # it's limited by the slower of the two.
+        limiting = (1.0, 1.0, 0.0)
+        speed = self.feed
+        axis_speed = self.profile.limit(self.profile.max_velocity, limiting)
+        if speed is None or speed > axis_speed:
+            speed = axis_speed
+        acceleration = self.profile.limit(self.profile.max_acceleration, limiting)
+        if acceleration is not None:
+            speed = min(speed, math.sqrt(acceleration * radius))
+        self.add_move(self.CUTTING, length, speed, limiting, entry, exit)
+
+    def add_move(self, kind, length, speed, direction, entry, exit):
+        acceleration = self.profile.limit(self.profile.max_acceleration, direction)
+        jerk = self.profile.limit(self.profile.max_jerk, direction)
+        self.moves.append((len(self.sections) - 1, kind, length, speed, acceleration, jerk, entry, exit))
+
+    def junction_speed(self, previous, next):
+        # The fastest the machine can go from the move `previous` to
+        # the move `next`, as in Grbl.
+        (a, b) = (previous[7], next[6])
+        cos_theta = -(a[0] * b[0] + a[1] * b[1] + a[2] * b[2])
+        if cos_theta > 1.0 - epsilon:
+            # Straight back the way it came.
+            return 0.0
+        speed = min(previous[3], next[3])
+        acceleration = [x for x in (previous[4], next[4]) if x is not None]
+        if cos_theta < -1.0 + epsilon or not acceleration:
+            # Straight on.
+            return speed
+        sin_half_theta = math.sqrt(0.5 * (1.0 - cos_theta))
+        limit = math.sqrt(min(acceleration) * self.profile.junction_deviation * sin_half_theta / (1.0 - sin_half_theta))
+        return min(speed, limit)
+
+    def move_time(self, move, entry_speed, exit_speed):
+        (section, kind, length, speed, acceleration, jerk, entry, exit) = move
+        if acceleration is None:
+            return length / speed
+        accelerate = (speed * speed - entry_speed * entry_speed) / (2.0 * acceleration)
+        decelerate = (speed * speed - exit_speed * exit_speed) / (2.0 * acceleration)
+        if accelerate + decelerate > length:
+            # No time to get up to speed.
+            speed = math.sqrt(acceleration * length + 0.5 * (entry_speed * entry_speed + exit_speed * exit_speed))
+            cruise = 0.0
+        else:
+            cruise = (length - accelerate - decelerate) / speed
+        t = cruise
+        for change in (speed - entry_speed, speed - exit_speed):
+            if change <= 0.0:
+                continue
+            t += change / acceleration
+            if jerk is not None:
+                if change >= acceleration * acceleration / jerk:
+                    t += acceleration / jerk
+                else:
+                    t += 2.0 * math.sqrt(change / jerk) - change / acceleration
+        return t
+
+    def times(self):
+        """Returns the estimated times, as a list with a (name, times)
+        tuple for each section that has moves.  `times` is a dict
+        mapping each kind of move ("cutting", "rapid", and "plunge") to
+        its time in seconds."""
+
+        moves = self.moves
+        n = len(moves)
+
+        # The fastest each move can start, given the corner before it,
+        # then limited by how fast the machine can slow down for the
+        # moves after it, and how fast it can speed up after the moves
+        # before it.
+        entry = [0.0] * (n + 1)
+        for k in range(1, n):
+            entry[k] = self.junction_speed(moves[k-1], moves[k])
+        for k in range(n - 1, -1, -1):
+            if moves[k][4] is not None:
+                entry[k] = min(entry[k], math.sqrt(entry[k+1] * entry[k+1] + 2.0 * moves[k][4] * moves[k][2]))
+        for k in range(n):
+            if moves[k][4] is not None:
+                entry[k+1] = min(entry[k+1], math.sqrt(entry[k] * entry[k] + 2.0 * moves[k][4] * moves[k][2]))
+
+        totals = [dict((kind, 0.0) for kind in self.KINDS) for name in self.sections]
+        used = [False] * len(self.sections)
+        for k in range(n):
+            section = moves[k][0]
+            totals[section][moves[k][1]] += self.move_time(moves[k], entry[k], entry[k+1])
+            used[section] = True
+        return [(self.sections[i], totals[i]) for i in range(len(self.sections)) if used[i]]
+
+    def report(self, out=None):
+        """Writes a summary of the estimated times to the file-like
+        object `out` (sys.stderr by default)."""
+        if out is None:
+            out = sys.stderr
+        total = dict((kind, 0.0) for kind in self.KINDS)
+        print("cycle time estimate:", file=out)
+        for (name, times) in self.times():
+            for kind in self.KINDS:
+                total[kind] += times[kind]
+            print("    %s: %s" % (name, format_cycle_times(times)), file=out)
+        print("    total: %s" % format_cycle_times(total), file=out)
+
+
+def format_cycle_times(times):
+    """Formats a dict of times from cycle_time_estimator.times() for
+    people to read."""
+    total = sum(times.values())
+    seconds = int(total + 0.5)
+    return "%.1f s cutting, %.1f s rapids, %.1f s plunges, %.1f s (%d:%02d) total" % (
+        times['cutting'], times['rapid'], times['plunge'], total, seconds // 60, seconds % 60
+    )
+
+
+class program(object):
+
+    """The program class writes a g-code program, and keeps track of the
+    machine state the program has set up so far.
+
+    `sink` is the file-like object the g-code is written to (see the
+    writer class), or None for sys.stdout.
+
+    Each program object has its own output and state, so several
+    programs can be written at the same time (for example from
+    different threads).  The module-level functions (g0(), g1(),
+    path_to_gcode(), etc) write to a shared default program.
+
+    If `compact` is True, the program leaves out words that don't change
+    anything: motion words (G0, G1, G2, G3) that are already the active
+    motion mode, axis words for axes that wouldn't move, and feed rate,
+    spindle speed, spindle on/off, and arc center mode words that
+    repeat the current setting.  Moves that wouldn't move any axis are
+    left out entirely.  Numbers are compared as they would be written
+    (to 4 decimal places).  Any g-code written directly to the program's
+    output (instead of through the program's methods) must not change
+    the modal state."""
+
+    def __init__(self, sink=None, compact=False):
+        self.output = writer(sink)
+        self.compact = compact
+
+        # The modal state set by the program so far, as a dict mapping
+        # the name of each modal setting ('motion', 'feed', 'speed',
+        # 'spindle', 'units', 'distance', 'arc-centers') to the words
+        # that set it.  A missing setting is not known.
+        self.modal = {}
+
+        # These keep track of where the most recent move left the
+        # controlled point, or None if the position is not known.
+        self.current_x = None
+        self.current_y = None
+        self.current_z = None
+        self.current_a = None
+        self.current_b = None
+        self.current_c = None
+        self.current_u = None
+        self.current_v = None
+        self.current_w = None
+
+
+    def set_output(self, sink):
+        """Sends all subsequent g-code to the file-like object `sink`
+        (or to sys.stdout if `sink` is None)."""
+        self.output.flush()
+        self.output.sink = sink
+
+
+    def flush(self):
+        """Writes out any buffered g-code."""
+        self.output.flush()
+
+
+    def _modal_line(self, name, value, text):
+        # Writes `text`, which sets the modal setting `name` to `value`.
+        # In compact mode, leaves it out if the setting already has that
+        # value.
+        if self.compact and self.modal.get(name) == value:
+            return
+        self.modal[name] = value
+        self.output.line(text)
+
+
+    def _motion_line(self, motion, words):
+        # Writes `words`, which start with the motion word `motion`.
+        # In compact mode, leaves off the motion word if it's already
+        # the active motion mode.
+        if self.compact and self.modal.get('motion') == motion:
+            words = words[len(motion)+1:]
+        self.modal['motion'] = motion
+        self.output.line(words)
+
+
+    def _compact_move(self, motion, axes):
+        # Writes a g0 or g1 move in compact mode.  `axes` is a list of
+        # (letter, attribute, value) tuples.  Only axes that actually
+        # move are written, and the position attributes track what was
+        # written.
+        words = ""
+        for (letter, attribute, value) in axes:
+            if value is None:
+                continue
+            word = "%.4f" % value
+            current = getattr(self, attribute)
+            if current is not None and word == "%.4f" % current:
+                continue
+            setattr(self, attribute, value)
+            words += " " + letter + word
+        if not words:
+            return
+        self._motion_line(motion, motion + words)
+
+
+    def path_to_gcode(self, svg, path, z_traverse=10, z_approach=None, z_top_of_material=0, z_cut_depth=0, lead_in=True, lead_out=True, feed=None, plunge_feed=None, flatten_tolerance=None, flatten_max_length=None, arc_tolerance=None, simplify_tolerance=None):
+
+        """Writes g-code to cut the svgpathtools.path.Path `path`, from the
+        SVG `svg`.
+
+        The path is compiled with compile_path() (see there for
+        `flatten_tolerance`, `flatten_max_length`, `arc_tolerance`, and
+        `simplify_tolerance`) and written with toolpath_to_gcode() (see
+        there for the other arguments).  To cut the same path more than
+        once, compile it once and call toolpath_to_gcode() for each cut.
+
+        Returns the number of segments and moves removed by
+        simplification."""
+
+        compiled = compile_path(
+            svg,
+            path,
+            flatten_tolerance=flatten_tolerance,
+            flatten_max_length=flatten_max_length,
+            arc_tolerance=arc_tolerance,
+            simplify_tolerance=simplify_tolerance
+        )
+        self.toolpath_to_gcode(
+            compiled,
+            z_traverse=z_traverse,
+            z_approach=z_approach,
+            z_top_of_material=z_top_of_material,
+            z_cut_depth=z_cut_depth,
+            lead_in=lead_in,
+            lead_out=lead_out,
+            feed=feed,
+            plunge_feed=plunge_feed
+        )
+        return compiled.removed
 
 
-def absolute():
-    print("G90")
+    def toolpath_to_gcode(self, toolpath, z_traverse=10, z_approach=None, z_top_of_material=0, z_cut_depth=0, lead_in=True, lead_out=True, feed=None, plunge_feed=None):
 
+        """Writes g-code to cut the toolpath object `toolpath` (see
+        compile_path()) at the Z level `z_cut_depth`.
 
-def absolute_arc_centers():
-    print("G90.1")
+        If `lead_in` is True, the tool goes up to `z_traverse`, over to
+        the start of the toolpath, rapids down to `z_approach` (0.5 mm
+        above `z_top_of_material` by default), and plunges to
+        `z_cut_depth` at `plunge_feed` (or `feed`).  If `lead_in` is
+        False the tool is assumed to be down already, and feeds to the
+        start of the toolpath.
 
+        If `lead_out` is True, the tool goes back up to `z_traverse`
+        at the end."""
 
-def relative_arc_centers():
-    print("G91.1")
+        self.absolute_arc_centers()
+        (x, y) = toolpath.start
 
+        if z_approach == None:
+            z_approach = 0.5 + z_top_of_material
 
-def spindle_on():
-    print("M3")
+        if lead_in:
+            self.g0(z=z_traverse)
+            self.g0(x=x, y=y)
 
+        self.spindle_on()
 
-def spindle_off():
-    print("M5")
+        if lead_in:
+            self.g0(z=z_approach)
+            if plunge_feed:
+                self.set_feed_rate(plunge_feed)
+            elif feed:
+                self.set_feed_rate(feed)
+            self.g1(z=z_cut_depth)
+            if plunge_feed and feed:
+                self.set_feed_rate(feed)
+        else:
+            if feed:
+                self.set_feed_rate(feed)
+            self.g1(x=x, y=y)
+
+        self._toolpath_moves(toolpath)
+
+        if lead_out:
+            self.g1(z=z_approach)
+            self.g0(z=z_traverse)
+
+
+    def _toolpath_moves(self, toolpath):
+        # Writes the moves of `toolpath`, with the tool at its start.
+        # The moves don't involve Z, so their text only depends on the
+        # compact setting and on the motion mode they start in.  The
+        # text is made once for each of those, and replayed after that.
+        key = (self.compact, self.modal.get('motion'))
+        if key not in toolpath.rendered:
+            output = self.output
+            rendered = StringIO.StringIO()
+            self.output = writer(sink=rendered, chunk_size=float('inf'))
+            try:
+                xy = toolpath.xy
+                ij = toolpath.ij
+                for (k, motion) in enumerate(toolpath.motions):
+                    if motion == toolpath.LINE:
+                        self.g1(x=xy[2*k], y=xy[2*k+1])
+                    elif motion == toolpath.ARC_CW:
+                        self.g2(x=xy[2*k], y=xy[2*k+1], i=ij[2*k], j=ij[2*k+1])
+                    else:
+                        self.g3(x=xy[2*k], y=xy[2*k+1], i=ij[2*k], j=ij[2*k+1])
+                self.output.flush()
+                text = rendered.getvalue()
+            finally:
+                self.output = output
+            toolpath.rendered[key] = (text, self.modal.get('motion'), self.current_x, self.current_y)
+        (text, motion, self.current_x, self.current_y) = toolpath.rendered[key]
+        if motion is not None:
+            self.modal['motion'] = motion
+        self.output.write(text)
+
+
+    def init(self):
+        self.output.line()
+        self.output.line("; init")
+        self.output.line("G20          (inch)")
+        self.modal['units'] = "G20"
+        self.output.line("G17          (xy plane)")
+        self.output.line("G90          (absolute)")
+        self.modal['distance'] = "G90"
+        self.output.line("G91.1        (arc centers are relative to arc starting point)")
+        self.modal['arc-centers'] = "G91.1"
+        self.cutter_comp_off()
+        self.output.line("G54          (switch to coordinate system 1)")
+        self.output.line("G94          (units/minute feed mode)")
+        self.output.line("G99          (in canned cycles, retract to the Z coordinate specified by the R word)")
+        self.output.line("G64 P0.0005  (enable path blending, but stay within 0.0005 of the programmed path)")
+        self.output.line("G49          (turn off tool length compensation)")
+        self.output.line("G80          (turn off canned cycles)")
+        self.modal.pop('motion', None)
+        self.output.line()
+
+
+    def comment(self, msg):
+        if msg:
+            self.output.line("; %s" % msg)
+        else:
+            self.output.line()
 
 
-def path_blend(tolerance=None):
-    print("G64 P%.4f (enable path blending with tolerance)" % tolerance)
+    def absolute(self):
+        self._modal_line('distance', "G90", "G90")
 
 
-def quill_up():
-    absolute()
-    cutter_comp_off()
-    print("G53 G0 Z0")
-    current_z = None
-    spindle_off()
+    def absolute_arc_centers(self):
+        self._modal_line('arc-centers', "G90.1", "G90.1")
 
 
-def presentation_position():
-    imperial()
-    quill_up()
+    def relative_arc_centers(self):
+        self._modal_line('arc-centers', "G91.1", "G91.1")
 
-    # rapid to presentation position
-    # table centered in X, all the way forward towards the user
-    print("G53 G0 X9 Y12")
-    current_x = None
-    current_y = None
 
+    def spindle_on(self):
+        self._modal_line('spindle', "M3", "M3")
 
-def m2():
-    print()
-    print("M2")
 
+    def spindle_off(self):
+        self._modal_line('spindle', "M5", "M5")
 
-def done():
-    print()
-    print("; done")
-    presentation_position()
-    print("M2")
 
+    def path_blend(self, tolerance=None):
+        self.output.line("G64 P%.4f (enable path blending with tolerance)" % tolerance)
 
-def imperial():
-    print("G20")
 
+    def quill_up(self):
+        self.absolute()
+        self.cutter_comp_off()
+        self.output.line("G53 G0 Z0")
+        self.modal['motion'] = "G0"
+        self.current_z = None
+        self.spindle_off()
 
-def metric():
-    print("G21")
 
+    def presentation_position(self):
+        self.imperial()
+        self.quill_up()
 
-def set_feed_rate(feed_rate_units_per_minute):
-    print("F %.4f" % feed_rate_units_per_minute)
+        # rapid to presentation position
+        # table centered in X, all the way forward towards the user
+        self.output.line("G53 G0 X9 Y12")
+        self.modal['motion'] = "G0"
+        self.current_x = None
+        self.current_y = None
 
 
-def speed(spindle_rpm):
-    print("S %d" % spindle_rpm)
+    def m2(self):
+        self.output.line()
+        self.output.line("M2")
+        self.output.flush()
 
 
-# FIXME: g0(path) should be merged or replaced by z_path() somehow
-def g0(path=None, x=None, y=None, z=None, a=None, b=None, c=None, u=None, v=None, w=None):
-    global current_x
-    global current_y
-    global current_z
-    global current_a
-    global current_b
-    global current_c
-    global current_u
-    global current_v
-    global current_w
+    def done(self):
+        self.output.line()
+        self.output.line("; done")
+        self.presentation_position()
+        self.output.line("M2")
+        self.output.flush()
 
-    if path is not None:
-        print()
-        print("; g0 path")
-        for waypoint in path:
-            g0(**waypoint)
-        print()
-    else:
-        print("G0", end='')
+
+    def imperial(self):
+        self._modal_line('units', "G20", "G20")
+
+
+    def metric(self):
+        self._modal_line('units', "G21", "G21")
+
+
+    def set_feed_rate(self, feed_rate_units_per_minute):
+        text = "F %.4f" % feed_rate_units_per_minute
+        self._modal_line('feed', text, text)
+
+
+    def speed(self, spindle_rpm):
+        text = "S %d" % spindle_rpm
+        self._modal_line('speed', text, text)
+
+
+    # FIXME: g0(path) should be merged or replaced by z_path() somehow
+    def g0(self, path=None, x=None, y=None, z=None, a=None, b=None, c=None, u=None, v=None, w=None):
+
+        if path is not None:
+            self.output.line()
+            self.output.line("; g0 path")
+            for waypoint in path:
+                self.g0(**waypoint)
+            self.output.line()
+        elif self.compact:
+            self._compact_move("G0", (
+                ('X', 'current_x', x), ('Y', 'current_y', y), ('Z', 'current_z', z),
+                ('A', 'current_a', a), ('B', 'current_b', b), ('C', 'current_c', c),
+                ('U', 'current_u', u), ('V', 'current_v', v), ('W', 'current_w', w)
+            ))
+        else:
+            words = "G0"
+            if x is not None:
+                self.current_x = x
+                words += " X%.4f" % x
+            if y is not None:
+                self.current_y = y
+                words += " Y%.4f" % y
+            if z is not None:
+                self.current_z = z
+                words += " Z%.4f" % z
+            if a is not None:
+                self.current_a = a
+                words += " A%.4f" % a
+            if b is not None:
+                self.current_b = b
+                words += " B%.4f" % b
+            if c is not None:
+                self.current_c = c
+                words += " C%.4f" % c
+            if u is not None:
+                self.current_u = u
+                words += " U%.4f" % u
+            if v is not None:
+                self.current_v = v
+                words += " V%.4f" % v
+            if w is not None:
+                self.current_w = w
+                words += " W%.4f" % w
+            self.modal['motion'] = words[:2]
+            self.output.line(words)
+
+
+    def g1(self, path=None, x=None, y=None, z=None, a=None, b=None, c=None, u=None, v=None, w=None):
+
+        if path is not None:
+            self.output.line()
+            self.output.line("; g1 path")
+            for waypoint in path:
+                self.g1(**waypoint)
+            self.output.line()
+        elif self.compact:
+            self._compact_move("G1", (
+                ('X', 'current_x', x), ('Y', 'current_y', y), ('Z', 'current_z', z),
+                ('A', 'current_a', a), ('B', 'current_b', b), ('C', 'current_c', c),
+                ('U', 'current_u', u), ('V', 'current_v', v), ('W', 'current_w', w)
+            ))
+        else:
+            words = "G1"
+            if x is not None:
+                self.current_x = x
+                words += " X%.4f" % x
+            if y is not None:
+                self.current_y = y
+                words += " Y%.4f" % y
+            if z is not None:
+                self.current_z = z
+                words += " Z%.4f" % z
+            if a is not None:
+                self.current_a = a
+                words += " A%.4f" % a
+            if b is not None:
+                self.current_b = b
+                words += " B%.4f" % b
+            if c is not None:
+                self.current_c = c
+                words += " C%.4f" % c
+            if u is not None:
+                self.current_u = u
+                words += " U%.4f" % u
+            if v is not None:
+                self.current_v = v
+                words += " V%.4f" % v
+            if w is not None:
+                self.current_w = w
+                words += " W%.4f" % w
+            self.modal['motion'] = words[:2]
+            self.output.line(words)
+
+
+    def g2(self, x=None, y=None, z=None, i=None, j=None, p=None):
+
+        """Clockwise arc feed."""
+        if i is None and j is None:
+            raise TypeError, "gcoder.g2() without i or j"
+        words = "G2"
         if x is not None:
-            current_x = x
-            print(" X%.4f" % x, end='')
+            self.current_x = x
+            words += " X%.4f" % x
         if y is not None:
-            current_y = y
-            print(" Y%.4f" % y, end='')
+            self.current_y = y
+            words += " Y%.4f" % y
         if z is not None:
-            current_z = z
-            print(" Z%.4f" % z, end='')
-        if a is not None:
-            current_a = a
-            print(" A%.4f" % a, end='')
-        if b is not None:
-            current_b = b
-            print(" B%.4f" % b, end='')
-        if c is not None:
-            current_c = c
-            print(" C%.4f" % c, end='')
-        if u is not None:
-            current_u = u
-            print(" U%.4f" % u, end='')
-        if v is not None:
-            current_v = v
-            print(" V%.4f" % v, end='')
-        if w is not None:
-            current_w = w
-            print(" W%.4f" % w, end='')
-        print()
-
-
-def g1(path=None, x=None, y=None, z=None, a=None, b=None, c=None, u=None, v=None, w=None):
-    global current_x
-    global current_y
-    global current_z
-    global current_a
-    global current_b
-    global current_c
-    global current_u
-    global current_v
-    global current_w
-
-    if path is not None:
-        print()
-        print("; g1 path")
-        for waypoint in path:
-            g1(**waypoint)
-        print()
-    else:
-        print("G1", end='')
+            self.current_z = z
+            words += " Z%.4f" % z
+        if i is not None: words += " I%.4f" % i
+        if j is not None: words += " J%.4f" % j
+        if p is not None: words += " P%.4f" % p
+        self._motion_line("G2", words)
+
+
+    def g3(self, x=None, y=None, z=None, i=None, j=None, p=None):
+
+        """Counter-clockwise arc feed."""
+        if i is None and j is None:
+            raise TypeError, "gcoder.g3() without i or j"
+        words = "G3"
         if x is not None:
-            current_x = x
-            print(" X%.4f" % x, end='')
+            self.current_x = x
+            words += " X%.4f" % x
         if y is not None:
-            current_y = y
-            print(" Y%.4f" % y, end='')
+            self.current_y = y
+            words += " Y%.4f" % y
         if z is not None:
-            current_z = z
-            print(" Z%.4f" % z, end='')
-        if a is not None:
-            current_a = a
-            print(" A%.4f" % a, end='')
-        if b is not None:
-            current_b = b
-            print(" B%.4f" % b, end='')
-        if c is not None:
-            current_c = c
-            print(" C%.4f" % c, end='')
-        if u is not None:
-            current_u = u
-            print(" U%.4f" % u, end='')
-        if v is not None:
-            current_v = v
-            print(" V%.4f" % v, end='')
-        if w is not None:
-            current_w = w
-            print(" W%.4f" % w, end='')
-        print()
-
-
-def g2(x=None, y=None, z=None, i=None, j=None, p=None):
-    global current_x
-    global current_y
-    global current_z
-
-    """Clockwise arc feed."""
-    if i is None and j is None:
-        raise TypeError, "gcoder.g2() without i or j"
-    print("G2", end='')
-    if x is not None:
-        current_x = x
-        print(" X%.4f" % x, end='')
-    if y is not None:
-        current_y = y
-        print(" Y%.4f" % y, end='')
-    if z is not None:
-        current_z = z
-        print(" Z%.4f" % z, end='')
-    if i is not None: print(" I%.4f" % i, end='')
-    if j is not None: print(" J%.4f" % j, end='')
-    if p is not None: print(" P%.4f" % p, end='')
-    print()
-
-
-def g3(x=None, y=None, z=None, i=None, j=None, p=None):
-    global current_x
-    global current_y
-    global current_z
-
-    """Counter-clockwise arc feed."""
-    if i is None and j is None:
-        raise TypeError, "gcoder.g3() without i or j"
-    print("G3", end='')
-    if x is not None:
-        current_x = x
-        print(" X%.4f" % x, end='')
-    if y is not None:
-        current_y = y
-        print(" Y%.4f" % y, end='')
-    if z is not None:
-        current_z = z
-        print(" Z%.4f" % z, end='')
-    if i is not None: print(" I%.4f" % i, end='')
-    if j is not None: print(" J%.4f" % j, end='')
-    if p is not None: print(" P%.4f" % p, end='')
-    print()
+            self.current_z = z
+            words += " Z%.4f" % z
+        if i is not None: words += " I%.4f" % i
+        if j is not None: words += " J%.4f" % j
+        if p is not None: words += " P%.4f" % p
+        self._motion_line("G3", words)
 
 
-#
-# Cutter compensation handling.
-#
+    #
+    # Cutter compensation handling.
+    #
 
-def cutter_comp_off():
-    print("G40          (cutter comp off)")
+    def cutter_comp_off(self):
+        self.output.line("G40          (cutter comp off)")
 
-def cancel_cutter_comp():
-    print("; gcoder: calling program used obsolete cancel_cutter_comp() function, use cutter_comp_off() instead")
-    cutter_comp_off()
+    def cancel_cutter_comp(self):
+        self.output.line("; gcoder: calling program used obsolete self.cancel_cutter_comp() function, use self.cutter_comp_off() instead")
+        self.cutter_comp_off()
 
-def g40():
-    print("; gcoder: calling program used obsolete g40() function, use cutter_comp_off() instead")
-    cutter_comp_off()
+    def g40(self):
+        self.output.line("; gcoder: calling program used obsolete self.g40() function, use self.cutter_comp_off() instead")
+        self.cutter_comp_off()
 
 
-def cutter_comp_left(**kwargs):
+    def cutter_comp_left(self, **kwargs):
 
-    """Enable cutter diameter compensation on the left side of the
-    programmed path.
+        """Enable cutter diameter compensation on the left side of the
+        programmed path.
 
-    When called with no argument, uses the diameter of the currently
-    loaded tool (from the tool table).
+        When called with no argument, uses the diameter of the currently
+        loaded tool (from the tool table).
 
-    When called with the `diameter` argument, uses the specified diameter.
+        When called with the `diameter` argument, uses the specified diameter.
 
-    When called with the `tool` argument (and without the `diameter`
-    argument), uses the diameter of the specified tool number (from the
-    tool table)."""
+        When called with the `tool` argument (and without the `diameter`
+        argument), uses the diameter of the specified tool number (from the
+        tool table)."""
 
-    if 'diameter' in kwargs:
-        print("G41.1 D%.4f   (cutter comp left, diameter mode)" % kwargs['diameter'])
-    elif 'tool' in kwargs:
-        print("G41 D%d   (cutter comp left, tool-number mode)" % kwargs['tool'])
-    else:
-        print("G41   (cutter comp left, current tool)")
+        if 'diameter' in kwargs:
+            self.output.line("G41.1 D%.4f   (cutter comp left, diameter mode)" % kwargs['diameter'])
+        elif 'tool' in kwargs:
+            self.output.line("G41 D%d   (cutter comp left, tool-number mode)" % kwargs['tool'])
+        else:
+            self.output.line("G41   (cutter comp left, current tool)")
 
 
-def cutter_comp_right(**kwargs):
+    def cutter_comp_right(self, **kwargs):
 
-    """Enable cutter diameter compensation on the right side of the
-    programmed path.
+        """Enable cutter diameter compensation on the right side of the
+        programmed path.
 
-    When called with no argument, uses the diameter of the currently
-    loaded tool (from the tool table).
+        When called with no argument, uses the diameter of the currently
+        loaded tool (from the tool table).
 
-    When called with the `diameter` argument, uses the specified diameter.
+        When called with the `diameter` argument, uses the specified diameter.
 
-    When called with the `tool` argument (and without the `diameter`
-    argument), uses the diameter of the specified tool number (from the
-    tool table)."""
+        When called with the `tool` argument (and without the `diameter`
+        argument), uses the diameter of the specified tool number (from the
+        tool table)."""
 
-    if 'diameter' in kwargs:
-        print("G42.1 D%.4f   (cutter comp right, diameter mode)" % kwargs['diameter'])
-    elif 'tool' in kwargs:
-        print("G42 D%d   (cutter comp right, tool-number mode)" % kwargs['tool'])
-    else:
-        print("G42   (cutter comp right, current tool)")
-
-def g42_1(comp_diameter):
-    print("; gcoder: calling program used obsolete g42_1() function, use cutter_comp_right() instead")
-    cutter_comp_right(diameter=comp_diameter)
-
-
-def g81(retract, x=None, y=None, z=None):
-    global current_x
-    global current_y
-    global current_z
-
-    print("G81", end='')
-    if x is not None:
-        current_x = x
-        print(" X%.4f" % x, end='')
-    if y is not None:
-        current_y = y
-        print(" Y%.4f" % y, end='')
-    if z is not None:
-        print(" Z%.4f" % z, end='')
-    print(" R%.4f" % retract, end='')
-    print()
-    # FIXME: keep track of retract mode, set Z correctly here
-    current_z = None
-
-
-def g83(retract, delta, x=None, y=None, z=None):
-    global current_x
-    global current_y
-    global current_z
-
-    print("G83", end='')
-    if x is not None:
-        current_x = x
-        print(" X%.4f" % x, end='')
-    if y is not None:
-        current_y = y
-        print(" Y%.4f" % y, end='')
-    if z is not None:
-        print(" Z%.4f" % z, end='')
-    print(" R%.4f" % retract, end='')
-    print(" Q%.4f" % delta, end='')
-    print()
-    # FIXME: keep track of retract mode, set Z correctly here
-    current_z = None
-
-
-def drill_hog(diameter, retract, delta, z_drill, x0, y0, x1, y1, xy_finishing_allowance=None, z_finishing_allowance=None):
-
-    """Drills as many evenly spaced holes as will fit in a rectangular
-    grid, within the rectangle defined by (x0, y0) and (x1, y1).
-    The specified rectangle describes the material contour, the holes
-    will be inset from the edges by the drill's radius.
-
-    If finishing_tolerance is specified, all the holes will stay at least
-    that far away from the material contour the specified rectangle.
-    If z_finishing_allowance is specified the holes will end that far
-    above the specified drill depth."""
-
-    print()
-    print("; drill hog")
-
-    radius = diameter/2.0
-
-    min_x = min(x0, x1)
-    max_x = max(x0, x1)
-
-    min_y = min(y0, y1)
-    max_y = max(y0, y1)
-
-    if xy_finishing_allowance != None:
-        min_x = min_x + xy_finishing_allowance
-        max_x = max_x - xy_finishing_allowance
-        min_y = min_y + xy_finishing_allowance
-        max_y = max_y - xy_finishing_allowance
-
-    if z_finishing_allowance != None:
-        z_drill = z_drill + z_finishing_allowance
-
-    x_range = max_x - min_x
-    y_range = max_y - min_y
-
-    num_in_x = int(math.floor(x_range / diameter))
-    num_in_y = int(math.floor(y_range / diameter))
-
-    min_x = min_x + radius
-    max_x = max_x - radius
-
-    min_y = min_y + radius
-    max_y = max_y - radius
-
-    x_range = x_range - diameter
-    y_range = y_range - diameter
-
-    for x_index in range(0, num_in_x):
-        if num_in_x > 1:
-            x = min_x + ((x_index / float(num_in_x - 1)) * x_range)
+        if 'diameter' in kwargs:
+            self.output.line("G42.1 D%.4f   (cutter comp right, diameter mode)" % kwargs['diameter'])
+        elif 'tool' in kwargs:
+            self.output.line("G42 D%d   (cutter comp right, tool-number mode)" % kwargs['tool'])
         else:
-            x = min_x + (x_range / 2.0)
+            self.output.line("G42   (cutter comp right, current tool)")
+
+    def g42_1(self, comp_diameter):
+        self.output.line("; gcoder: calling program used obsolete self.g42_1() function, use self.cutter_comp_right() instead")
+        self.cutter_comp_right(diameter=comp_diameter)
+
+
+    def g81(self, retract, x=None, y=None, z=None):
+
+        words = "G81"
+        if x is not None:
+            self.current_x = x
+            words += " X%.4f" % x
+        if y is not None:
+            self.current_y = y
+            words += " Y%.4f" % y
+        if z is not None:
+            words += " Z%.4f" % z
+        words += " R%.4f" % retract
+        self.modal['motion'] = "G81"
+        self.output.line(words)
+        # FIXME: keep track of retract mode, set Z correctly here
+        self.current_z = None
+
+
+    def g83(self, retract, delta, x=None, y=None, z=None):
+
+        words = "G83"
+        if x is not None:
+            self.current_x = x
+            words += " X%.4f" % x
+        if y is not None:
+            self.current_y = y
+            words += " Y%.4f" % y
+        if z is not None:
+            words += " Z%.4f" % z
+        words += " R%.4f" % retract
+        words += " Q%.4f" % delta
+        self.modal['motion'] = "G83"
+        self.output.line(words)
+        # FIXME: keep track of retract mode, set Z correctly here
+        self.current_z = None
+
+
+    def drill_hog(self, diameter, retract, delta, z_drill, x0, y0, x1, y1, xy_finishing_allowance=None, z_finishing_allowance=None):
+
+        """Drills as many evenly spaced holes as will fit in a rectangular
+        grid, within the rectangle defined by (x0, y0) and (x1, y1).
+        The specified rectangle describes the material contour, the holes
+        will be inset from the edges by the drill's radius.
+
+        If finishing_tolerance is specified, all the holes will stay at least
+        that far away from the material contour the specified rectangle.
+        If z_finishing_allowance is specified the holes will end that far
+        above the specified drill depth."""
+
+        self.output.line()
+        self.output.line("; drill hog")
+
+        radius = diameter/2.0
+
+        min_x = min(x0, x1)
+        max_x = max(x0, x1)
+
+        min_y = min(y0, y1)
+        max_y = max(y0, y1)
+
+        if xy_finishing_allowance != None:
+            min_x = min_x + xy_finishing_allowance
+            max_x = max_x - xy_finishing_allowance
+            min_y = min_y + xy_finishing_allowance
+            max_y = max_y - xy_finishing_allowance
+
+        if z_finishing_allowance != None:
+            z_drill = z_drill + z_finishing_allowance
+
+        x_range = max_x - min_x
+        y_range = max_y - min_y
+
+        num_in_x = int(math.floor(x_range / diameter))
+        num_in_y = int(math.floor(y_range / diameter))
 
-        for y_index in range(0, num_in_y):
-            if num_in_y > 1:
-                y = min_y + ((y_index / float(num_in_y - 1)) * y_range)
+        min_x = min_x + radius
+        max_x = max_x - radius
+
+        min_y = min_y + radius
+        max_y = max_y - radius
+
+        x_range = x_range - diameter
+        y_range = y_range - diameter
+
+        for x_index in range(0, num_in_x):
+            if num_in_x > 1:
+                x = min_x + ((x_index / float(num_in_x - 1)) * x_range)
             else:
-                y = min_y + (y_range / 2.0)
+                x = min_x + (x_range / 2.0)
 
-            g83(x=x, y=y, z=z_drill, delta=delta, retract=retract)
+            for y_index in range(0, num_in_y):
+                if num_in_y > 1:
+                    y = min_y + ((y_index / float(num_in_y - 1)) * y_range)
+                else:
+                    y = min_y + (y_range / 2.0)
 
-    print()
+                self.g83(x=x, y=y, z=z_drill, delta=delta, retract=retract)
 
+        self.output.line()
 
-def z_path(path, depth_of_cut, z_start, z_top_of_work, z_target):
 
-    """This function traverses a path (a list of waypoints), cutting a
-    little deeper on each pass.  The waypoints are (X, Y) coordinates.
-    The motion is this:
+    def z_path(self, path, depth_of_cut, z_start, z_top_of_work, z_target):
 
-        1. Set Z to z_start.
+        """This function traverses a path (a list of waypoints), cutting a
+        little deeper on each pass.  The waypoints are (X, Y) coordinates.
+        The motion is this:
 
-        2. If z_top_of_work is below z_start, set Z level to z_top_of_work
-           and feed down to Z (otherwise don't move the controlled point).
+            1. Set Z to z_start.
 
-        3. Reduce Z by depth_of_cut, but not below z_target.
+            2. If z_top_of_work is below z_start, set Z level to z_top_of_work
+               and feed down to Z (otherwise don't move the controlled point).
 
-        4. Feed to each waypoint in path, in order starting with the
-           first and ending with the last.
+            3. Reduce Z by depth_of_cut, but not below z_target.
 
-        5. After arriving at the last waypoint, if Z is not yet down to
-           z_target: feed to the first waypoint while ramping down by
-           depth_of_cut (but not below z_target), then go back to step
-           4 for another trip around the path at this Z level.
+            4. Feed to each waypoint in path, in order starting with the
+               first and ending with the last.
 
-        6. After reaching step 5 with Z at z_target, feed back to the
-           first waypoint while keeping Z at the z_target level, thereby
-           cutting away the ramp left by the previous iteration.
+            5. After arriving at the last waypoint, if Z is not yet down to
+               z_target: feed to the first waypoint while ramping down by
+               depth_of_cut (but not below z_target), then go back to step
+               4 for another trip around the path at this Z level.
 
+            6. After reaching step 5 with Z at z_target, feed back to the
+               first waypoint while keeping Z at the z_target level, thereby
+               cutting away the ramp left by the previous iteration.
 
-    The first move of this function is to the first waypoint in the
-    path, at a Z level that's depth-of-cut below the lower of z_start
-    and z_top_of_material (but not below z_target).  If you position
-    the cutter above the *last* waypoint in the path, you'll get a nice
-    consistent ramp down to the first waypoint each time around the path.
 
-    When the function returns the controlled point is once again at the
-    first waypoint in the path, all the way down at Z=z_target."""
+        The first move of this function is to the first waypoint in the
+        path, at a Z level that's depth-of-cut below the lower of z_start
+        and z_top_of_material (but not below z_target).  If you position
+        the cutter above the *last* waypoint in the path, you'll get a nice
+        consistent ramp down to the first waypoint each time around the path.
 
-    z = z_start
+        When the function returns the controlled point is once again at the
+        first waypoint in the path, all the way down at Z=z_target."""
 
-    if z > z_top_of_work:
-        z = z_top_of_work
-        g1(z = z)
+        z = z_start
 
-    while z > z_target:
-        z = z - depth_of_cut
-        if z < z_target:
-            z = z_target
+        if z > z_top_of_work:
+            z = z_top_of_work
+            self.g1(z = z)
 
-        for waypoint in path:
-            g1(x=waypoint['x'], y=waypoint['y'], z=z)
+        while z > z_target:
+            z = z - depth_of_cut
+            if z < z_target:
+                z = z_target
 
-    # Cut away the last ramp we left behind.
-    g1(**path[0])
+            for waypoint in path:
+                self.g1(x=waypoint['x'], y=waypoint['y'], z=z)
 
+        # Cut away the last ramp we left behind.
+        self.g1(**path[0])
 
-def z_path2(path, depth_of_cut, z_target):
 
-    """This function traverses a path (a list of Line, ArcCW, and ArcCCW
-    objects), cutting a little deeper on each pass.
+    def z_path2(self, path, depth_of_cut, z_target):
 
-    z_path2() has a local variable named "Z" that tracks the Z level
-    of the current pass.  On entry to the function it is initialized
-    to gcoder's current Z position.  The Z variable overrides any Z
-    coordinates specified in the path.
+        """This function traverses a path (a list of Line, ArcCW, and ArcCCW
+        objects), cutting a little deeper on each pass.
 
-    The motion is this:
+        z_path2() has a local variable named "Z" that tracks the Z level
+        of the current pass.  On entry to the function it is initialized
+        to gcoder's current Z position.  The Z variable overrides any Z
+        coordinates specified in the path.
 
-        1. Initialize the local variable Z to gcoder's current Z
-           coordinate.
+        The motion is this:
 
-        2. Reduce Z by depth_of_cut, but not below z_target.
+            1. Initialize the local variable Z to gcoder's current Z
+               coordinate.
 
-        3. Feed to each waypoint in path, in order starting with the
-           first and ending with the last.
+            2. Reduce Z by depth_of_cut, but not below z_target.
 
-        4. After arriving at the last waypoint, if Z is not yet down to
-           z_target, go to step 2.
+            3. Feed to each waypoint in path, in order starting with the
+               first and ending with the last.
 
-        5. After reaching step 4 with Z at z_target, feed back to the
-           first waypoint while keeping Z at the z_target level, thereby
-           cutting away the ramp left by the previous iteration.
+            4. After arriving at the last waypoint, if Z is not yet down to
+               z_target, go to step 2.
 
-    The first move of this function is to the first waypoint in the path,
-    at a Z level that's depth-of-cut below the starting Z level (but not
-    below z_target).  If you position the cutter at the *last* waypoint
-    in the path, at the start-of-material Z level, you'll get a nice
-    consistent ramp down to the first waypoint each time around the path.
+            5. After reaching step 4 with Z at z_target, feed back to the
+               first waypoint while keeping Z at the z_target level, thereby
+               cutting away the ramp left by the previous iteration.
 
-    When the function returns the controlled point is once again at the
-    first waypoint in the path, all the way down at Z=z_target."""
+        The first move of this function is to the first waypoint in the path,
+        at a Z level that's depth-of-cut below the starting Z level (but not
+        below z_target).  If you position the cutter at the *last* waypoint
+        in the path, at the start-of-material Z level, you'll get a nice
+        consistent ramp down to the first waypoint each time around the path.
 
-    def handle_item(item):
-        if type(item) is line:
-            g1(x=item.x, y=item.y, z=z)
-        elif type(item) is arc_cw:
-            g2(x=item.x, y=item.y, z=z, i=item.i, j=item.j, p=item.p)
-        elif type(item) is arc_ccw:
-            g3(x=item.x, y=item.y, z=z, i=item.i, j=item.j, p=item.p)
-        else:
-            raise TypeError('z_path2() only accepts line(), arc_cw(), and arc_ccw() objects')
+        When the function returns the controlled point is once again at the
+        first waypoint in the path, all the way down at Z=z_target."""
 
-    z = current_z
+        def handle_item(item):
+            if type(item) is line:
+                self.g1(x=item.x, y=item.y, z=z)
+            elif type(item) is arc_cw:
+                self.g2(x=item.x, y=item.y, z=z, i=item.i, j=item.j, p=item.p)
+            elif type(item) is arc_ccw:
+                self.g3(x=item.x, y=item.y, z=z, i=item.i, j=item.j, p=item.p)
+            else:
+                raise TypeError('z_path2() only accepts line(), arc_cw(), and arc_ccw() objects')
 
-    # Shrink depth_of_cut so all passes are equally deep, instead of
-    # letting the final pass be "whatever's left over".
-    z_range = current_z - z_target
-    num_passes = math.ceil(float(z_range) / depth_of_cut)
-    depth_of_cut = z_range / num_passes
+        z = self.current_z
 
-    while not close_enough(z, z_target):
-        z = z - depth_of_cut
-        if z < z_target:
-            z = z_target
+        # Shrink depth_of_cut so all passes are equally deep, instead of
+        # letting the final pass be "whatever's left over".
+        z_range = self.current_z - z_target
+        num_passes = math.ceil(float(z_range) / depth_of_cut)
+        depth_of_cut = z_range / num_passes
 
-        for item in path:
-            handle_item(item)
+        while not close_enough(z, z_target):
+            z = z - depth_of_cut
+            if z < z_target:
+                z = z_target
 
-    # Cut away the last ramp we left behind.
-    handle_item(path[0])
+            for item in path:
+                handle_item(item)
 
+        # Cut away the last ramp we left behind.
+        handle_item(path[0])
 
-def helix_hole(x, y, z_retract, z_start, z_bottom, diameter, doc):
 
-    """This function helix-mills a hole.  The motion is this:
+    def helix_hole(self, x, y, z_retract, z_start, z_bottom, diameter, doc):
 
-        1. Rapid to Z=z_retract.
+        """This function helix-mills a hole.  The motion is this:
 
-        2. Rapid to the vincinity of (X, Y).
+            1. Rapid to Z=z_retract.
 
-        3. Rapid to Z=z_start.
+            2. Rapid to the vincinity of (X, Y).
 
-        4. Helix down to Z=z_bottom, descending not more than Z=doc
-           per revolution.
+            3. Rapid to Z=z_start.
 
-        5. One more full circle at Z=z_bottom, to flatten the floor.
+            4. Helix down to Z=z_bottom, descending not more than Z=doc
+               per revolution.
 
-        6. Feed to the center of the hole and up off the floor a
-           little bit.
+            5. One more full circle at Z=z_bottom, to flatten the floor.
 
-        7. Rapid up to Z=z_retract."""
+            6. Feed to the center of the hole and up off the floor a
+               little bit.
 
-    r = diameter / 2.0
+            7. Rapid up to Z=z_retract."""
 
-    z_range = z_start - z_bottom
-    full_circles = math.ceil(z_range / doc)
+        r = diameter / 2.0
 
-    absolute_arc_centers()
+        z_range = z_start - z_bottom
+        full_circles = math.ceil(z_range / doc)
 
-    # get in position for the cut
-    g0(z=z_retract)
-    g0(x=x+r, y=y)
-    g0(z=z_start)
+        self.absolute_arc_centers()
 
-    # helix down, then flatten the bottom
-    g2(x=x+r, y=y, z=z_bottom, p=full_circles, i=x, j=y)
-    g2(x=x+r, y=y, z=z_bottom, i=x, j=y)
+        # get in position for the cut
+        self.g0(z=z_retract)
+        self.g0(x=x+r, y=y)
+        self.g0(z=z_start)
 
-    # extract the tool from the work
-    g1(x=x, y=y, z=z_bottom + 0.025)
-    g0(z=z_retract)
+        # helix down, then flatten the bottom
+        self.g2(x=x+r, y=y, z=z_bottom, p=full_circles, i=x, j=y)
+        self.g2(x=x+r, y=y, z=z_bottom, i=x, j=y)
 
+        # extract the tool from the work
+        self.g1(x=x, y=y, z=z_bottom + 0.025)
+        self.g0(z=z_retract)
 
-def saw_square(x_start, y_start, z_start, x_end, y_end, z_end, max_doc, rapid_plunge=True, final_retract=True):
 
-    """Cuts back and forth between (X=x_start, Y=y_start) and (X=x_end,
-    Y=y_end), plunging Z down (rapid or feed) at the end of each pass.
+    def saw_square(self, x_start, y_start, z_start, x_end, y_end, z_end, max_doc, rapid_plunge=True, final_retract=True):
 
-    The actual depth of cut may be reduced a little from max_doc to
-    achieve equal depth of cut on each pass, while minimizing the number
-    of passes.
+        """Cuts back and forth between (X=x_start, Y=y_start) and (X=x_end,
+        Y=y_end), plunging Z down (rapid or feed) at the end of each pass.
 
-    Upon return the tool will be positioned at either (X=x_start,
-    Y=y_start) or at (X=x_end, Y=y_end), and at either Z=z_start (if
-    final_retract is True) or Z=z_end (if final_retract is False).
+        The actual depth of cut may be reduced a little from max_doc to
+        achieve equal depth of cut on each pass, while minimizing the number
+        of passes.
 
-    Motion:
+        Upon return the tool will be positioned at either (X=x_start,
+        Y=y_start) or at (X=x_end, Y=y_end), and at either Z=z_start (if
+        final_retract is True) or Z=z_end (if final_retract is False).
 
-        Initial Motion:
+        Motion:
 
-            Rapid to X=x_start, Y=y_start.
+            Initial Motion:
 
-            Spindle on.
+                Rapid to X=x_start, Y=y_start.
 
-            Rapid to Z=z_start.
+                Spindle on.
 
-        Cycle:
+                Rapid to Z=z_start.
 
-            Plunge Z down by actual_doc, but not below z_end (rapid or
-            feed, determined by rapid_plunge).
+            Cycle:
 
-            Feed to X=x_end, Y=y_end.
+                Plunge Z down by actual_doc, but not below z_end (rapid or
+                feed, determined by rapid_plunge).
 
-            If Z is at z_end, goto Done.
+                Feed to X=x_end, Y=y_end.
 
-            Plunge Z down by actual_doc, but not below z_end (rapid or
-            feed, determined by rapid_plunge).
+                If Z is at z_end, goto Done.
 
-            Feed to X=x_start, Y=y_start.
+                Plunge Z down by actual_doc, but not below z_end (rapid or
+                feed, determined by rapid_plunge).
 
-            If Z is at z_end, goto Done.
+                Feed to X=x_start, Y=y_start.
 
-            Goto Cycle.
+                If Z is at z_end, goto Done.
 
-        Done:
+                Goto Cycle.
 
-            If final_retract is True, rapid to Z=z_start."""
+            Done:
 
-    global epsilon
+                If final_retract is True, rapid to Z=z_start."""
 
-    z_range = z_start - z_end
-    num_passes = math.ceil(z_range / max_doc)
-    doc = z_range / num_passes
+        global epsilon
 
-    g0(x=x_start, y=y_start)
+        z_range = z_start - z_end
+        num_passes = math.ceil(z_range / max_doc)
+        doc = z_range / num_passes
 
-    spindle_on();
+        self.g0(x=x_start, y=y_start)
 
-    z = z_start
-    g0(z=z)
+        self.spindle_on();
 
-    while not close_enough(z, z_end):
-        z = z - doc
-        if z < z_end:
-            z = z_end
-        if rapid_plunge:
-            g0(z=z)
-        else:
-            g1(z=z)
-        g1(x=x_end, y=y_end)
+        z = z_start
+        self.g0(z=z)
 
-        if not close_enough(z, z_end):
+        while not close_enough(z, z_end):
             z = z - doc
             if z < z_end:
                 z = z_end
             if rapid_plunge:
-                g0(z=z)
+                self.g0(z=z)
             else:
-                g1(z=z)
-            g1(x=x_start, y=y_start)
+                self.g1(z=z)
+            self.g1(x=x_end, y=y_end)
+
+            if not close_enough(z, z_end):
+                z = z - doc
+                if z < z_end:
+                    z = z_end
+                if rapid_plunge:
+                    self.g0(z=z)
+                else:
+                    self.g1(z=z)
+                self.g1(x=x_start, y=y_start)
+
+        if final_retract:
+            self.g0(z=z_start)
+
+
+#
+# The module-level g-code functions write to this default program.
+#
+
+default_program = program()
+
+
+def current_position(axis):
+    """Returns the default program's current position on `axis` (one of
+    the letters 'x', 'y', 'z', 'a', 'b', 'c', 'u', 'v', 'w'), or None
+    if it's not known.  The position lives in the default program, as
+    default_program.current_x and so on."""
+    return getattr(default_program, 'current_' + axis)
+
+
+# The module-level functions are the default program's methods.  They
+# write to stdout as they go, so their g-code stays in order with
+# anything else the program prints.  If the output is sent somewhere
+# else with set_output(), it's buffered until flush().
+for _name in [
+    'set_output', 'flush', 'path_to_gcode', 'toolpath_to_gcode',
+    'init', 'comment', 'absolute', 'absolute_arc_centers',
+    'relative_arc_centers', 'spindle_on', 'spindle_off', 'path_blend',
+    'quill_up', 'presentation_position', 'm2', 'done', 'imperial',
+    'metric', 'set_feed_rate', 'speed',
+    'g0', 'g1', 'g2', 'g3', 'g81', 'g83',
+    'cutter_comp_off', 'cancel_cutter_comp', 'g40', 'cutter_comp_left',
+    'cutter_comp_right', 'g42_1',
+    'drill_hog', 'z_path', 'z_path2', 'helix_hole', 'saw_square'
+]:
+    globals()[_name] = getattr(default_program, _name)
+del _name
+
+
+atexit.register(flush)
+
+
+class _compatible_module(types.ModuleType):
+
+    """Scripts written before the machine state moved into the program
+    class read it as gcoder.current_x (and so on, through current_w)
+    and gcoder.output.  Those still work, read-only: this stands in for
+    the gcoder module in sys.modules, and passes everything else on to
+    the real module."""
+
+    def __init__(self, module):
+        types.ModuleType.__init__(self, module.__name__, module.__doc__)
+        self.__dict__['_module'] = module
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+    def __setattr__(self, name, value):
+        if isinstance(getattr(type(self), name, None), property):
+            raise AttributeError("gcoder.%s is read-only, set default_program.%s instead" % (name, name))
+        setattr(self._module, name, value)
+
+    def __delattr__(self, name):
+        delattr(self._module, name)
+
+    def __dir__(self):
+        return sorted(set(dir(self._module)) | set(['current_' + axis for axis in 'xyzabcuvw'] + ['output']))
+
+    output = property(lambda self: default_program.output)
 
-    if final_retract:
-        g0(z=z_start)
+for _axis in 'xyzabcuvw':
+    setattr(_compatible_module, 'current_' + _axis, property(lambda self, axis=_axis: current_position(axis)))
+del _axis
 
+sys.modules[__name__] = _compatible_module(sys.modules[__name__])
@@ -0,0 +1,37 @@
+#!/usr/bin/env python2
+
+import gcoder
+
+g = gcoder.program(compact=True)
+
+g.metric()
+g.metric()
+g.speed(1000)
+g.spindle_on()
+g.set_feed_rate(100)
+
+g.g0(x=0, y=0, z=5)
+g.g0(x=0, y=0, z=1)
+g.spindle_on()
+
+g.set_feed_rate(100)
+g.g1(z=-1)
+g.g1(x=10, y=0, z=-1)
+g.g1(x=10.00001, y=0)
+g.g1(x=10, y=10)
+g.g1(x=0)
+
+g.absolute_arc_centers()
+g.g2(x=0, y=0, i=0, j=5)
+g.g2(x=0, y=10, i=0, j=5)
+g.absolute_arc_centers()
+g.g1(x=0, y=0)
+
+g.set_feed_rate(50)
+g.g1(z=1)
+g.g0(z=5)
+g.spindle_off()
+
+g.quill_up()
+g.g0(z=5)
+g.m2()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python2
+
+import gcoder
+
+# A machine with slow Z, and acceleration limits on all axes.
+profile = gcoder.machine_profile(
+    axes={
+        'x': {'max-velocity': 6000, 'max-acceleration': 500, 'max-jerk': 5000},
+        'y': {'max-velocity': 6000, 'max-acceleration': 500, 'max-jerk': 5000},
+        'z': {'max-velocity': 1200, 'max-acceleration': 100}
+    },
+    junction_deviation=0.01
+)
+
+estimator = gcoder.cycle_time_estimator(profile)
+p = gcoder.program(sink=estimator)
+
+p.metric()
+p.absolute_arc_centers()
+p.g0(x=0, y=0, z=10)
+estimator.section("square")
+p.g0(z=0.5)
+p.set_feed_rate(100)
+p.g1(z=-1)
+p.set_feed_rate(1200)
+p.g1(x=50)
+p.g1(y=50)
+p.g1(x=0)
+p.g1(y=0)
+p.g0(z=10)
+
+p.flush()
+estimator.section("circle")
+p.g0(x=100, y=25)
+p.g0(z=0.5)
+p.set_feed_rate(100)
+p.g1(z=-1)
+p.set_feed_rate(1200)
+p.g2(x=100, y=25, i=75, j=25)
+p.g0(z=10)
+p.flush()
+
+# Feeding back up isn't plunging.  The G53 move in quill_up() takes no
+# time, and the move after it starts from an unknown Z, so it's not
+# counted either.
+estimator.section("retract")
+p.g0(z=0.5)
+p.set_feed_rate(100)
+p.g1(z=-1)
+p.g1(z=0.5)
+p.quill_up()
+p.g0(z=10)
+p.g0(x=0, y=0)
+p.flush()
+
+# The estimates go in the output as comments, so they're checked.
+for (name, times) in estimator.times():
+    p.comment("%s: %.4f cutting, %.4f rapid, %.4f plunge" % (name, times['cutting'], times['rapid'], times['plunge']))
+p.m2()
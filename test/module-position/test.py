@@ -0,0 +1,22 @@
+#!/usr/bin/env python2
+
+import gcoder
+
+# Older scripts read the default program's position and output as
+# gcoder module attributes.
+gcoder.g0(x=1, y=2, z=3)
+gcoder.g1(z=gcoder.current_z - 1)
+gcoder.comment("x=%s y=%s z=%s a=%s" % (gcoder.current_x, gcoder.current_y, gcoder.current_z, gcoder.current_a))
+
+gcoder.output.line("(written to gcoder.output)")
+
+try:
+    gcoder.current_z = 0
+    gcoder.comment("gcoder.current_z should be read-only")
+except AttributeError:
+    pass
+
+gcoder.quill_up()
+if gcoder.current_z is not None:
+    gcoder.comment("quill_up() should forget the Z position")
+gcoder.m2()
@@ -0,0 +1,24 @@
+#!/usr/bin/env python2
+
+import gcoder
+import svgpathtools
+
+# A 10x10 square, both ways around.  offset_paths() offsets a positive
+# distance to the left of the path, so it shrinks the counter-clockwise
+# square and grows the clockwise one, and both engines must agree.
+ccw = svgpathtools.Path(
+    svgpathtools.Line(0+0j, 0+10j),
+    svgpathtools.Line(0+10j, 10+10j),
+    svgpathtools.Line(10+10j, 10+0j),
+    svgpathtools.Line(10+0j, 0+0j)
+)
+cw = ccw.reversed()
+
+for (name, path) in (("counter-clockwise", ccw), ("clockwise", cw)):
+    for engine in ("native", "clipper"):
+        for distance in (1, -1):
+            paths = gcoder.offset_paths(path, distance, engine=engine, arc_tolerance=0.01)
+            areas = ["%.2f" % abs(gcoder.path_area(gcoder.refresh_arcs(p))) for p in paths]
+            gcoder.comment("%s square, %s engine, offset %d: areas %s" % (name, engine, distance, ", ".join(areas)))
+
+gcoder.m2()
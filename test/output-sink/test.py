@@ -0,0 +1,23 @@
+#!/usr/bin/env python2
+
+import StringIO
+import sys
+
+import gcoder
+
+gcoder.comment("to stdout")
+gcoder.g0(x=1, y=2)
+
+# Send some g-code to an in-memory file, then pass it along.
+f = StringIO.StringIO()
+gcoder.set_output(f)
+gcoder.comment("to a StringIO")
+gcoder.g1(x=3, y=4, z=-1)
+gcoder.g2(x=5, y=4, i=4, j=4)
+gcoder.set_output(None)
+
+gcoder.comment("back to stdout")
+gcoder.flush()
+sys.stdout.write(f.getvalue())
+
+gcoder.m2()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python2
+
+import math
+
+import gcoder
+import svgpathtools
+
+# Cross-checks the exact path_area() against approximate_path_area()
+# and against a polygon through 1,000 points on each segment, on
+# circular Arcs, cubic Beziers, and an elliptical Arc.  Positive area
+# means clockwise (in SVG's Y-down coordinates), negative means
+# counter-clockwise.
+
+def sampled_area(path, samples=1000):
+    area = 0.0
+    for seg in path:
+        for i in range(samples):
+            a = seg.point(i / float(samples))
+            b = seg.point((i + 1) / float(samples))
+            area += (a.real * b.imag - a.imag * b.real) / 2.0
+    return area
+
+# Right, down, left, up: clockwise on the screen.
+circle = svgpathtools.Path(
+    svgpathtools.Arc(10+0j, 10+10j, 0, False, True, -10+0j),
+    svgpathtools.Arc(-10+0j, 10+10j, 0, False, True, 10+0j)
+)
+
+blob = svgpathtools.Path(
+    svgpathtools.CubicBezier(0j, 10-5j, 20+5j, 20+10j),
+    svgpathtools.CubicBezier(20+10j, 15+25j, -5+20j, 0j)
+)
+
+# An ellipse rotated 30 degrees, cut off by a chord, counter-clockwise.
+ellipse = svgpathtools.Path(
+    svgpathtools.Arc(0j, 8+3j, 30, True, False, 10+4j),
+    svgpathtools.Line(10+4j, 0j)
+)
+
+for (name, path, clockwise) in (("circle", circle, True), ("cubic blob", blob, True), ("elliptical arc", ellipse, False)):
+    for (direction, p, cw) in (("forward", path, clockwise), ("reversed", path.reversed(), not clockwise)):
+        exact = gcoder.path_area(p)
+        approximate = gcoder.approximate_path_area(p)
+        sampled = sampled_area(p)
+        assert abs(exact - approximate) < 1e-4 * abs(exact), (name, direction, exact, approximate)
+        assert abs(exact - sampled) < 1e-4 * abs(exact), (name, direction, exact, sampled)
+        assert (exact > 0) == cw, (name, direction, exact)
+        gcoder.comment("%s, %s: area %.3f, %s" % (name, direction, exact, "clockwise" if exact > 0 else "counter-clockwise"))
+
+assert abs(gcoder.path_area(circle) - math.pi * 100) < 1e-9
+
+gcoder.m2()
@@ -0,0 +1,19 @@
+#!/usr/bin/env python2
+
+from __future__ import print_function
+
+import sys
+
+import gcoder
+
+# Lines the program prints itself come out in order with gcoder's
+# g-code, without any flush() calls.
+print("; header printed by the program")
+gcoder.absolute()
+gcoder.g0(x=0, y=0, z=1)
+print("M100 (a custom M-code)")
+gcoder.g1(x=1, y=2, z=-1)
+sys.stdout.write("; written with sys.stdout.write()\n")
+gcoder.g1(x=3, y=4)
+print("; footer printed by the program")
+gcoder.m2()
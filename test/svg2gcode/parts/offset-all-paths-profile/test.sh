@@ -0,0 +1,8 @@
+#!/bin/bash
+#
+# Cut the parts out with a negative offset: the outlines grow and the
+# holes shrink, so the tool stays out of the parts everywhere.  The
+# island in the round hole is a part too, so it grows.
+#
+
+svg2gcode --all-paths --job job.json test.svg
@@ -0,0 +1,9 @@
+#!/bin/bash
+#
+# Offset every closed path in the SVG: the holes, and the island in
+# the round hole, come before the parts around them.  The positive
+# offset goes into the material: the outlines (and the island) shrink,
+# and the holes grow.
+#
+
+svg2gcode --all-paths --job job.json test.svg
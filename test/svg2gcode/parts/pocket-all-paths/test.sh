@@ -0,0 +1,8 @@
+#!/bin/bash
+#
+# Pocket the inside of each outline, leaving the paths inside it
+# standing as islands.  The holes are islands, so they aren't pocketed
+# themselves, but the island in the round hole is pocketed around.
+#
+
+svg2gcode --all-paths --job job.json test.svg
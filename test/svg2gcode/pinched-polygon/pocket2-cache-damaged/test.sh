@@ -0,0 +1,36 @@
+#!/bin/bash
+#
+# Damage every file the first run put in the cache, so each one fails
+# to unpickle (with an ImportError).  The second run must treat them
+# as missing, write the same g-code, and replace them, so a third run
+# gets them all from the cache.
+#
+
+CACHE_DIR=$(mktemp -d)
+STDERR=$(mktemp)
+DAMAGED=$(python2 -c 'import sys, zlib; sys.stdout.write(zlib.compress("cno_such_module\nthing\n."))' | md5sum)
+
+fail() {
+    echo "$@" 1>&2
+    cat ${STDERR} 1>&2
+    rm -rf ${CACHE_DIR} ${STDERR}
+    exit 1
+}
+
+svg2gcode --cache-dir ${CACHE_DIR} --job job.json test.svg > /dev/null 2> ${STDERR} || fail "first run failed"
+MISSES=$(sed -n 's/^offset cache: 0 hits, \([0-9]*\) misses$/\1/p' ${STDERR})
+[ -n "${MISSES}" ] || fail "first run didn't miss"
+for F in ${CACHE_DIR}/*.offset; do
+    python2 -c 'import sys, zlib; sys.stdout.write(zlib.compress("cno_such_module\nthing\n."))' > ${F}
+done
+
+svg2gcode --cache-dir ${CACHE_DIR} --job job.json test.svg 2> ${STDERR} || fail "second run failed"
+grep -q "^offset cache: 0 hits, ${MISSES} misses$" ${STDERR} || fail "damaged files didn't count as misses"
+for F in ${CACHE_DIR}/*.offset; do
+    [ "$(md5sum < ${F})" != "${DAMAGED}" ] || fail "damaged file ${F} wasn't replaced"
+done
+
+svg2gcode --cache-dir ${CACHE_DIR} --job job.json test.svg > /dev/null 2> ${STDERR} || fail "third run failed"
+grep -q "^offset cache: ${MISSES} hits, 0 misses$" ${STDERR} || fail "third run didn't get every result from the cache"
+
+rm -rf ${CACHE_DIR} ${STDERR}
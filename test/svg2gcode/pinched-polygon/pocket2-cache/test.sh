@@ -0,0 +1,28 @@
+#!/bin/bash
+#
+# The second run gets all its offset paths from the cache the first
+# run filled, and should write the same g-code.  A stale temporary
+# file, left by a writer that was killed, is cleaned up.
+#
+
+CACHE_DIR=$(mktemp -d)
+STDERR=$(mktemp)
+
+fail() {
+    echo "$@" 1>&2
+    cat ${STDERR} 1>&2
+    rm -rf ${CACHE_DIR} ${STDERR}
+    exit 1
+}
+
+touch -d '2 hours ago' ${CACHE_DIR}/0123456789abcdef.offset.1234.tmp
+svg2gcode --cache-dir ${CACHE_DIR} --job job.json test.svg > /dev/null 2> ${STDERR} || fail "first run failed"
+grep -q '^offset cache: 0 hits, [1-9][0-9]* misses$' ${STDERR} || fail "first run didn't miss"
+MISSES=$(sed -n 's/^offset cache: 0 hits, \([0-9]*\) misses$/\1/p' ${STDERR})
+[ $(ls ${CACHE_DIR}/*.offset 2> /dev/null | wc -l) -eq ${MISSES} ] || fail "first run didn't store every result"
+[ -z "$(ls ${CACHE_DIR}/*.tmp 2> /dev/null)" ] || fail "stale temporary file left in the cache"
+
+svg2gcode --cache-dir ${CACHE_DIR} --job job.json test.svg 2> ${STDERR} || fail "second run failed"
+grep -q "^offset cache: ${MISSES} hits, 0 misses$" ${STDERR} || fail "second run didn't get every result from the cache"
+
+rm -rf ${CACHE_DIR} ${STDERR}
@@ -0,0 +1,7 @@
+#!/bin/bash
+#
+# The pocket leaves two islands, remove them in parallel.  The g-code
+# must be the same as the serial run of test.s2g.
+#
+
+svg2gcode --jobs 2 --job test.s2g test.svg
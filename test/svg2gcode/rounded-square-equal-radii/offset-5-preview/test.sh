@@ -0,0 +1,12 @@
+#!/bin/bash
+#
+# Writing a preview mustn't change the g-code, and the preview must be
+# complete by the time svg2gcode exits.
+#
+
+PREVIEW=$(mktemp --suffix=.svg)
+svg2gcode --preview ${PREVIEW} --job job.json test.svg
+RESULT=$?
+grep -q "<path" ${PREVIEW} || RESULT=1
+rm -f ${PREVIEW}
+exit ${RESULT}
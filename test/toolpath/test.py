@@ -0,0 +1,33 @@
+#!/usr/bin/env python2
+
+import gcoder
+
+# A square with one rounded corner, compiled by hand.
+square = gcoder.toolpath((0.0, 0.0))
+square.line_to(10.0, 0.0)
+square.line_to(10.0, 8.0)
+square.arc_to(8.0, 10.0, 8.0, 8.0, clockwise=False)
+square.line_to(0.0, 10.0)
+square.line_to(0.0, 0.0)
+
+gcoder.metric()
+gcoder.speed(1000)
+
+# Cut it at three depths, the moves are the same each time.
+for z in [-0.5, -1.0, -1.5]:
+    gcoder.comment("depth %.4f" % z)
+    gcoder.toolpath_to_gcode(square, z_cut_depth=z, feed=100, plunge_feed=50, lead_out=False)
+gcoder.g0(z=10)
+gcoder.flush()
+
+# A compact program gets its own text of the moves.
+g = gcoder.program(compact=True)
+g.metric()
+g.speed(1000)
+g.comment("compact depth -0.5000")
+g.toolpath_to_gcode(square, z_cut_depth=-0.5, feed=100, plunge_feed=50, lead_out=False)
+g.comment("compact depth -1.0000, plunging at the start")
+g.set_feed_rate(50)
+g.g1(z=-1.0)
+g.toolpath_to_gcode(square, z_cut_depth=-1.0, feed=100, lead_in=False)
+g.m2()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python2
+
+import StringIO
+import sys
+
+import gcoder
+
+# Write two programs at the same time, each with its own output and
+# its own idea of the current position.
+a_file = StringIO.StringIO()
+b_file = StringIO.StringIO()
+
+a = gcoder.program(a_file)
+b = gcoder.program(b_file)
+
+a.comment("program a")
+b.comment("program b")
+
+a.g0(x=1, y=2, z=3)
+b.g0(z=10)
+b.quill_up()
+
+a.g1(z=a.current_z - 1)
+if b.current_z is not None:
+    b.comment("quill_up() should forget the Z position")
+
+a.m2()
+b.m2()
+
+sys.stdout.write(a_file.getvalue())
+sys.stdout.write(b_file.getvalue())
+
+# The default program is unaffected.
+if gcoder.current_position('z') is not None:
+    gcoder.comment("default program has a Z position")
+gcoder.m2()